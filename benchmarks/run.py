@@ -0,0 +1,236 @@
+"""
+Endpoint benchmarks: drives the app in-process (TestClient) against DATABASE_URL
+and reports, per scenario, latency percentiles, throughput, SQL statements per
+request, response size and peak Python memory of one request as JSON, to compare
+across commits. The memory is measured on an extra, untimed request (tracemalloc
+slows allocations down); the process peak RSS is reported once for the whole run.
+
+    DATABASE_URL=postgresql://... python benchmarks/seed.py --reset
+    DATABASE_URL=postgresql://... python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --only pei_list,pei_export_csv --iterations 50
+
+The upload and job creation scenarios remove what they created afterwards.
+The dashboards are measured uncached: their caches are cleared before each request.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from benchmarks.seed import table_counts
+from database import engine
+from main import app
+from query_counter import count_queries
+from routes import dashboard, pei
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rows per uploaded file, and carteirinhas per job creation request
+UPLOAD_ROWS = 1000
+JOB_BATCH = 500
+# Uploaded codes use this prefix, so they can be told apart and removed
+UPLOAD_PREFIX = "9999"
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    url: str
+    # Extra TestClient arguments (json, files...) for the i-th request
+    request: Optional[Callable[[int], dict]] = None
+    # Run before every request, outside the measured time
+    before: Optional[Callable[[], None]] = None
+    setup: Optional[Callable[[], None]] = None
+    cleanup: Optional[Callable[[], None]] = None
+
+def upload_request(i):
+    lines = ["carteirinha,paciente,id_paciente,id_pagamento"]
+    lines += [f"{UPLOAD_PREFIX}.{i:04d}.{n:06d}.00-5,Paciente Upload {n},{n},{n}" for n in range(UPLOAD_ROWS)]
+    data = ("\n".join(lines) + "\n").encode()
+    return {"files": {"file": ("carteirinhas.csv", io.BytesIO(data), "text/csv")}, "data": {"overwrite": "false"}}
+
+def remove_uploaded():
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM carteirinhas WHERE carteirinha LIKE :prefix"), {"prefix": f"{UPLOAD_PREFIX}.%"})
+
+_state = {}
+
+def remember_last_job():
+    with engine.connect() as connection:
+        _state["last_job_id"] = connection.execute(text("SELECT coalesce(max(id), 0) FROM jobs")).scalar()
+        _state["job_carteirinhas"] = connection.execute(
+            text("SELECT id FROM carteirinhas ORDER BY id LIMIT :n"), {"n": JOB_BATCH}
+        ).scalars().all()
+
+def remove_created_jobs():
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM jobs WHERE id > :id"), {"id": _state["last_job_id"]})
+
+def clear_dashboard_caches():
+    dashboard.stats_cache.invalidate()
+    pei.invalidate_dashboard_cache()
+
+SCENARIOS = [
+    Scenario("carteirinhas_list", "GET", "/carteirinhas/?limit=100"),
+    Scenario("carteirinhas_list_cursor", "GET", "/carteirinhas/?limit=100&cursor="),
+    Scenario("carteirinhas_search", "GET", "/carteirinhas/?limit=100&search=Silva"),
+    Scenario("jobs_list", "GET", "/jobs/?limit=100"),
+    Scenario("jobs_list_cursor", "GET", "/jobs/?limit=100&cursor="),
+    Scenario("guias_list", "GET", "/guias/?limit=100"),
+    Scenario("guias_list_cursor", "GET", "/guias/?limit=100&cursor="),
+    Scenario("pei_list", "GET", "/pei/?pageSize=100"),
+    Scenario("pei_search", "GET", "/pei/?pageSize=100&search=Silva"),
+    Scenario("logs_list", "GET", "/api/logs/?limit=100"),
+    Scenario("dashboard_stats", "GET", "/dashboard/stats", before=clear_dashboard_caches),
+    Scenario("pei_dashboard", "GET", "/pei/dashboard", before=clear_dashboard_caches),
+    Scenario("guias_export", "GET", "/guias/export"),
+    Scenario("pei_export_xlsx", "GET", "/pei/export?format=xlsx"),
+    Scenario("pei_export_csv", "GET", "/pei/export?format=csv"),
+    Scenario("pei_recompute", "POST", "/pei/recompute", request=lambda i: {"json": {}}),
+    Scenario(
+        "jobs_create", "POST", "/jobs/",
+        request=lambda i: {"json": {"type": "multiple", "carteirinha_ids": _state["job_carteirinhas"]}},
+        setup=remember_last_job, cleanup=remove_created_jobs
+    ),
+    Scenario(
+        "carteirinhas_upload", "POST", "/carteirinhas/upload",
+        request=upload_request, setup=remove_uploaded, cleanup=remove_uploaded
+    ),
+]
+
+def percentile(values, pct):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def peak_alloc_mb(client, scenario, i, headers):
+    """Peak memory traced by tracemalloc during one request (all threads, Python allocations)."""
+    if scenario.before:
+        scenario.before()
+    kwargs = scenario.request(i) if scenario.request else {}
+    tracemalloc.start()
+    try:
+        client.request(scenario.method, scenario.url, headers=headers, **kwargs).raise_for_status()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 1)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scenario(client, scenario, iterations, warmup, headers):
+    latencies, statements, sizes = [], [], []
+    if scenario.setup:
+        scenario.setup()
+    try:
+        for i in range(warmup + iterations):
+            if scenario.before:
+                scenario.before()
+            kwargs = scenario.request(i) if scenario.request else {}
+            with count_queries() as counter:
+                started = time.perf_counter()
+                response = client.request(scenario.method, scenario.url, headers=headers, **kwargs)
+                elapsed = time.perf_counter() - started
+            response.raise_for_status()
+            if i >= warmup:
+                latencies.append(elapsed * 1000)
+                statements.append(counter.count)
+                sizes.append(len(response.content))
+        peak_alloc = peak_alloc_mb(client, scenario, warmup + iterations, headers)
+    finally:
+        if scenario.cleanup:
+            scenario.cleanup()
+
+    return {
+        "method": scenario.method,
+        "url": scenario.url,
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "max_ms": round(max(latencies), 2),
+        "throughput_rps": round(len(latencies) / (sum(latencies) / 1000), 1),
+        "queries": max(statements),
+        "response_bytes": max(sizes),
+        "peak_alloc_mb": peak_alloc
+    }
+
+def run_benchmarks(names=None, iterations=20, warmup=2):
+    headers = {}
+    # Needed when the app runs with AUTH_REQUIRED
+    if os.getenv("API_KEY"):
+        headers["Authorization"] = f"Bearer {os.getenv('API_KEY')}"
+
+    report = {
+        "benchmark": "endpoints",
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "env": {name: os.getenv(name) for name in ("DB_POOL_MODE", "DB_ASYNC", "DB_POOL_SIZE")},
+        "dataset": table_counts(),
+        "scenarios": {},
+        "errors": {}
+    }
+    scenarios = [s for s in SCENARIOS if names is None or s.name in names]
+    with TestClient(app) as client:
+        for scenario in scenarios:
+            try:
+                report["scenarios"][scenario.name] = run_scenario(client, scenario, iterations, warmup, headers)
+                result = report["scenarios"][scenario.name]
+                print(f"✓ {scenario.name}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, {result['queries']} queries", file=sys.stderr)
+            except Exception as e:
+                report["errors"][scenario.name] = str(e)
+                print(f"❌ {scenario.name}: {e}", file=sys.stderr)
+    # High-water mark of the whole process: every scenario that ran so far
+    report["process_peak_rss_mb"] = peak_rss_mb()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot endpoints in-process")
+    parser.add_argument("--iterations", type=int, default=20, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests per scenario")
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.list:
+        for scenario in SCENARIOS:
+            print(f"{scenario.name}: {scenario.method} {scenario.url}")
+        sys.exit(0)
+
+    names = set(args.only.split(",")) if args.only else None
+    unknown = names - {s.name for s in SCENARIOS} if names else None
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    report = run_benchmarks(names, args.iterations, args.warmup)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["errors"] else 0)
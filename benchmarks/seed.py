@@ -0,0 +1,201 @@
+"""
+Synthetic data for the benchmarks: carteirinhas, jobs, base_guias, pei_temp, patient_pei and logs
+Everything is generated server side (INSERT ... SELECT generate_series) in one transaction,
+deterministic for a given --seed. Run migrate_runner.py on the database first.
+
+    DATABASE_URL=postgresql://... python benchmarks/seed.py --reset
+    DATABASE_URL=postgresql://... python benchmarks/seed.py --carteirinhas 50000 --logs 2000000
+
+Without --reset rows are added next to the existing ones.
+"""
+
+import argparse
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, text
+
+from database import SessionLocal
+from models import BaseGuia, Carteirinha, Job, Log, PatientPei, PeiTemp
+from pei_engine import recompute_pei
+
+TABLES = {
+    "carteirinhas": Carteirinha,
+    "jobs": Job,
+    "base_guias": BaseGuia,
+    "pei_temp": PeiTemp,
+    "patient_pei": PatientPei,
+    "logs": Log
+}
+
+CODIGOS_TERAPIA = ["2250005", "2250013", "2250021", "2250030", "2250048", "2250056", "2250064", "2250072"]
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Daniel", "Eduarda", "Felipe", "Gabriela", "Heitor", "Isabela", "João",
+               "Laura", "Miguel", "Nicole", "Otávio", "Paula", "Rafael", "Sofia", "Thiago", "Valentina", "Enzo"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira", "Lima", "Gomes",
+              "Costa", "Ribeiro", "Martins", "Carvalho", "Almeida", "Lopes", "Soares", "Fernandes", "Vieira", "Barbosa"]
+
+def table_counts(db=None):
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        return {name: db.execute(select(func.count()).select_from(model)).scalar() for name, model in TABLES.items()}
+    finally:
+        if own:
+            db.close()
+
+def reset(db):
+    db.execute(text(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE"))
+
+def insert_carteirinhas(db, count, base_id):
+    # Codes follow the 0000.0000.000000.00-0 mask, numbered after the current max id
+    db.execute(text("""
+        INSERT INTO carteirinhas (carteirinha, paciente, id_paciente, id_pagamento, status)
+        SELECT
+            '0064.' || lpad(((n / 1000000) % 10000)::text, 4, '0') || '.' || lpad((n % 1000000)::text, 6, '0') || '.00-5',
+            (:first_names)[1 + n % cardinality(:first_names)] || ' ' ||
+                (:last_names)[1 + (n / cardinality(:first_names)) % cardinality(:last_names)] || ' ' ||
+                (:last_names)[1 + (n * 7) % cardinality(:last_names)],
+            n,
+            100000 + n,
+            CASE WHEN random() < 0.95 THEN 'ativo' ELSE 'inativo' END
+        FROM generate_series(:base + 1, :base + :count) AS n
+        ON CONFLICT (carteirinha) DO NOTHING
+    """), {"base": base_id, "count": count, "first_names": FIRST_NAMES, "last_names": LAST_NAMES})
+
+def insert_guias(db, per_carteirinha, terapias, base_id):
+    # Several guias per (carteirinha, terapia) pair once per_carteirinha > terapias: the latest one wins
+    db.execute(text("""
+        INSERT INTO base_guias (carteirinha_id, guia, data_autorizacao, senha, validade, codigo_terapia,
+                                qtde_solicitada, sessoes_autorizadas, created_at, updated_at)
+        SELECT
+            c.id,
+            (c.id::bigint * 1000 + g.n)::text,
+            g.autorizacao,
+            substr(md5(random()::text), 1, 10),
+            g.autorizacao + 60,
+            (:codigos)[1 + (g.n - 1) % :terapias],
+            g.qtde,
+            g.qtde,
+            g.autorizacao + make_interval(secs => random() * 86400),
+            g.autorizacao + make_interval(secs => random() * 86400)
+        FROM carteirinhas c
+        CROSS JOIN LATERAL (
+            SELECT n,
+                   current_date - floor(random() * 365)::int AS autorizacao,
+                   (ARRAY[16, 32, 48, 20, 10, NULL])[1 + floor(random() * 6)::int] AS qtde
+            FROM generate_series(1, :per_carteirinha) AS n
+            -- Correlated with c, so the random values are drawn again for every carteirinha
+            WHERE c.id > 0
+        ) g
+        WHERE c.id > :base
+    """), {"base": base_id, "per_carteirinha": per_carteirinha, "terapias": terapias, "codigos": CODIGOS_TERAPIA})
+
+def insert_overrides(db, fraction, base_id):
+    db.execute(text("""
+        INSERT INTO pei_temp (base_guia_id, pei_semanal)
+        SELECT id, 1 + floor(random() * 5) FROM base_guias
+        WHERE carteirinha_id > :base AND random() < :fraction
+        ON CONFLICT (base_guia_id) DO NOTHING
+    """), {"base": base_id, "fraction": fraction})
+
+def insert_jobs(db, per_carteirinha, base_id):
+    db.execute(text("""
+        INSERT INTO jobs (carteirinha_id, status, attempts, priority, locked_by, timeout, created_at, updated_at)
+        SELECT c.id, j.status,
+               CASE j.status WHEN 'error' THEN 4 WHEN 'success' THEN 1 ELSE 0 END,
+               (random() < 0.1)::int,
+               CASE WHEN j.status = 'processing' THEN 'worker-' || (c.id % 4) END,
+               CASE WHEN j.status = 'processing' THEN now() + interval '10 minutes' END,
+               j.created_at, j.created_at
+        FROM carteirinhas c
+        CROSS JOIN LATERAL (
+            SELECT (ARRAY['success', 'success', 'success', 'pending', 'pending', 'processing', 'error'])[1 + floor(random() * 7)::int] AS status,
+                   now() - random() * interval '30 days' AS created_at
+            FROM generate_series(1, :per_carteirinha)
+            -- Correlated with c, so the random values are drawn again for every carteirinha
+            WHERE c.id > 0
+        ) j
+        WHERE c.id > :base
+    """), {"base": base_id, "per_carteirinha": per_carteirinha})
+
+def insert_logs(db, count, days, base_job_id):
+    # Monthly partitions for the whole range (migration 0008), when the table is partitioned
+    if db.execute(text("SELECT to_regproc('ensure_logs_partition') IS NOT NULL")).scalar():
+        db.execute(text("""
+            SELECT ensure_logs_partition(month::date) FROM generate_series(
+                date_trunc('month', (now() - make_interval(days => :days)) AT TIME ZONE 'UTC'),
+                date_trunc('month', now() AT TIME ZONE 'UTC'),
+                interval '1 month'
+            ) AS month
+        """), {"days": days})
+    db.execute(text("""
+        WITH new_jobs AS (
+            SELECT array_agg(id ORDER BY id) AS ids, array_agg(carteirinha_id ORDER BY id) AS carteirinha_ids
+            FROM jobs WHERE id > :base
+        )
+        INSERT INTO logs (job_id, carteirinha_id, level, message, created_at)
+        SELECT
+            ids[1 + n % cardinality(ids)],
+            carteirinha_ids[1 + n % cardinality(ids)],
+            (ARRAY['INFO', 'INFO', 'INFO', 'INFO', 'WARN', 'ERROR'])[1 + n % 6],
+            'Processando guia ' || n || ': ' || substr(md5(n::text), 1, 24),
+            now() - random() * make_interval(days => :days)
+        FROM new_jobs, generate_series(1, :count) AS n
+    """), {"base": base_job_id, "count": count, "days": days})
+
+def seed(carteirinhas=5000, guias_per_carteirinha=4, terapias=4, jobs_per_carteirinha=2,
+         logs=100000, overrides=0.05, log_days=90, random_seed=0.42, do_reset=False):
+    db = SessionLocal()
+    try:
+        if do_reset:
+            reset(db)
+            print("✓ Tables truncated")
+        db.execute(text("SELECT setseed(:seed)"), {"seed": random_seed})
+        base_id = db.execute(select(func.coalesce(func.max(Carteirinha.id), 0))).scalar()
+        base_job_id = db.execute(select(func.coalesce(func.max(Job.id), 0))).scalar()
+
+        insert_carteirinhas(db, carteirinhas, base_id)
+        insert_guias(db, guias_per_carteirinha, min(terapias, len(CODIGOS_TERAPIA)), base_id)
+        insert_overrides(db, overrides, base_id)
+        insert_jobs(db, jobs_per_carteirinha, base_id)
+        insert_logs(db, logs, log_days, base_job_id)
+        pei_rows = recompute_pei(db)
+        db.commit()
+        print(f"✓ Data generated ({pei_rows} patient_pei rows computed)")
+
+        for table in TABLES:
+            db.execute(text(f"ANALYZE {table}"))
+        db.commit()
+        counts = table_counts(db)
+    finally:
+        db.close()
+
+    for table, count in counts.items():
+        print(f"  {table}: {count}")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate benchmark data in DATABASE_URL")
+    parser.add_argument("--carteirinhas", type=int, default=5000)
+    parser.add_argument("--guias-per-carteirinha", type=int, default=4)
+    parser.add_argument("--terapias", type=int, default=4, help=f"distinct codigo_terapia values (max {len(CODIGOS_TERAPIA)})")
+    parser.add_argument("--jobs-per-carteirinha", type=int, default=2)
+    parser.add_argument("--logs", type=int, default=100000)
+    parser.add_argument("--overrides", type=float, default=0.05, help="fraction of guias with a pei_temp override")
+    parser.add_argument("--log-days", type=int, default=90, help="logs are spread over this many past days")
+    parser.add_argument("--seed", type=float, default=0.42, help="Postgres setseed() value, between -1 and 1")
+    parser.add_argument("--reset", action="store_true", help="truncate the benchmark tables first")
+    args = parser.parse_args()
+
+    seed(
+        carteirinhas=args.carteirinhas,
+        guias_per_carteirinha=args.guias_per_carteirinha,
+        terapias=args.terapias,
+        jobs_per_carteirinha=args.jobs_per_carteirinha,
+        logs=args.logs,
+        overrides=args.overrides,
+        log_days=args.log_days,
+        random_seed=args.seed,
+        do_reset=args.reset
+    )
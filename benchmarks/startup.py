@@ -0,0 +1,99 @@
+"""
+Cold boot benchmark: time from launching a uvicorn worker to its first served request
+Each run starts a fresh interpreter, so imports, app creation and the lifespan
+(SCHEMA_CHECK, POOL_WARMUP) are all included. Also reports how long `import main` takes.
+Prints a JSON report.
+
+    DATABASE_URL=postgresql://... python benchmarks/startup.py --runs 5
+    POOL_WARMUP=5 python benchmarks/startup.py --path /dashboard/stats
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def measure_import():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+def measure_boot(path, timeout):
+    """Milliseconds from spawning the worker to the first 2xx response on `path`."""
+    port = free_port()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}")
+    # Needed when the app runs with AUTH_REQUIRED
+    if os.getenv("API_KEY"):
+        request.add_header("Authorization", f"Bearer {os.getenv('API_KEY')}")
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker exited during startup:\n{process.stderr.read().decode()}")
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                return (time.perf_counter() - started) * 1000
+            except urllib.error.HTTPError:
+                raise
+            except OSError:
+                # Not listening yet
+                time.sleep(0.005)
+        raise RuntimeError(f"No response within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+def summary(values):
+    return {
+        "min": round(min(values), 1),
+        "median": round(statistics.median(values), 1),
+        "max": round(max(values), 1),
+        "runs": [round(v, 1) for v in values]
+    }
+
+def run_benchmark(runs, path, timeout):
+    imports = [measure_import() for _ in range(runs)]
+    boots = [measure_boot(path, timeout) for _ in range(runs)]
+    return {
+        "benchmark": "startup",
+        "path": path,
+        "env": {name: os.getenv(name) for name in ("SCHEMA_CHECK", "POOL_WARMUP", "DB_POOL_MODE", "DB_ASYNC")},
+        "import_main_ms": summary(imports),
+        "boot_to_first_response_ms": summary(boots),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold boot to first served request")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="endpoint of the first request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each boot")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.runs, args.path, args.timeout)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,113 @@
+"""
+Small in-process caches shared by the routers.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe key/value cache whose entries expire after `ttl` seconds.
+
+    With `maxsize`, the least recently used entry is evicted once the cache is
+    full. get_or_load() is single-flight: when several requests miss the same
+    key at once, only one of them runs the loader and the others wait for it.
+    `ttl` can be overridden per entry (set(), or get_or_load() with a number or
+    a function of the loaded value).
+    """
+
+    def __init__(self, ttl: float, maxsize: int = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._async_key_locks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired entries so keys that are never read again (e.g. a past day) don't pile up
+            expired = [k for k, (expires_at, _) in self._data.items() if expires_at <= now]
+            for k in expired:
+                del self._data[k]
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def _entry_ttl(self, ttl, value):
+        return ttl(value) if callable(ttl) else ttl
+
+    def _hold_key_lock(self, key_locks, key, new_lock):
+        # [lock, holders]: the lock stays registered while anyone holds or waits for
+        # it, so a caller arriving meanwhile queues behind it instead of loading again
+        with self._lock:
+            entry = key_locks.get(key)
+            if entry is None:
+                entry = key_locks[key] = [new_lock(), 0]
+            entry[1] += 1
+            return entry
+
+    def _release_key_lock(self, key_locks, key, entry):
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del key_locks[key]
+
+    def get_or_load(self, key, loader, ttl=None):
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        entry = self._hold_key_lock(self._key_locks, key, threading.Lock)
+        try:
+            with entry[0]:
+                # Another thread may have loaded it while we were waiting
+                value = self.get(key, _missing)
+                if value is _missing:
+                    value = loader()
+                    self.set(key, value, self._entry_ttl(ttl, value))
+        finally:
+            self._release_key_lock(self._key_locks, key, entry)
+        return value
+
+    async def get_or_load_async(self, key, loader, ttl=None):
+        """get_or_load() for event-loop callers; `loader` is a coroutine function."""
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        entry = self._hold_key_lock(self._async_key_locks, key, asyncio.Lock)
+        try:
+            async with entry[0]:
+                value = self.get(key, _missing)
+                if value is _missing:
+                    value = await loader()
+                    self.set(key, value, self._entry_ttl(ttl, value))
+        finally:
+            self._release_key_lock(self._async_key_locks, key, entry)
+        return value
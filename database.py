@@ -1,6 +1,14 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
@@ -17,14 +25,203 @@ DB_HOST = os.getenv("SUPABASE_DB_HOST", "")
 DB_PORT = os.getenv("SUPABASE_DB_PORT", "5432")
 DB_NAME = os.getenv("SUPABASE_DB_NAME", "postgres")
 
-# Construct URL
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Construct URL (DATABASE_URL, when set, takes precedence: local runs, benchmarks)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-# If variables are missing, fallback or error (but we'll assume they are there as per user context)
-# Note: For Supabase transaction pooler (port 6543), we might need to disable statement cache working with sqlalchemy
-# engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+# Pool configuration
+# "queue": regular SQLAlchemy pool (direct connection or Supabase session pooler, port 5432)
+# "null": no client-side pool, one connection per checkout. Default for the Supabase
+#         transaction pooler (port 6543), which already pools and recycles server connections
+DB_POOL_MODE = os.getenv("DB_POOL_MODE") or ("null" if make_url(SQLALCHEMY_DATABASE_URL).port == 6543 else "queue")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# 0 disables the server-side statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Also build an asyncpg engine and serve the hot read endpoints from async handlers
+DB_ASYNC = _env_bool("DB_ASYNC", False)
+
+class PoolStats:
+    """Checkout counters, shared by the pool and the /system/pool endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if timed_out:
+                self.timeouts += 1
+
+pool_wait_stats = PoolStats()
+
+class _WaitTimingMixin:
+    """Records how long each checkout waited for a connection (queue wait or connect time)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_wait_stats.record(time.perf_counter() - started)
+        return connection
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    pass
+
+class InstrumentedNullPool(_WaitTimingMixin, NullPool):
+    pass
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+def build_engine_options():
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if DB_POOL_MODE == "null":
+        options["poolclass"] = InstrumentedNullPool
+    else:
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+        if DB_STATEMENT_TIMEOUT_MS:
+            # Startup option, set once per connection
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **build_engine_options())
+
+def _set_statement_timeout(conn):
+    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+if DB_POOL_MODE == "null" and DB_STATEMENT_TIMEOUT_MS:
+    # Transaction poolers reject startup options and share server connections,
+    # so the timeout is set per transaction instead
+    event.listen(engine, "begin", _set_statement_timeout)
+
+def build_async_engine_options():
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    connect_args = {}
+    if DB_POOL_MODE == "null":
+        options["poolclass"] = InstrumentedNullPool
+        # A transaction pooler may hand each statement to a different server
+        # connection: no cached prepared statements, and unique names for the
+        # ones asyncpg still prepares
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__"
+        )
+    else:
+        options.update(
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+        if DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    # Imported only when enabled, so asyncpg stays optional
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    ASYNC_DATABASE_URL = make_url(SQLALCHEMY_DATABASE_URL).set(drivername="postgresql+asyncpg")
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **build_async_engine_options())
+    if DB_POOL_MODE == "null" and DB_STATEMENT_TIMEOUT_MS:
+        event.listen(async_engine.sync_engine, "begin", _set_statement_timeout)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+def app_engines():
+    """The engines event listeners go on: the async engine (DB_ASYNC) is
+    instrumented through its sync counterpart."""
+    return [engine] + ([async_engine.sync_engine] if async_engine is not None else [])
+
+def instrument_engines(listeners: dict):
+    """Attach {event name: listener} to every app engine, once (safe to call again)."""
+    for bind in app_engines():
+        for name, listener in listeners.items():
+            if not event.contains(bind, name, listener):
+                event.listen(bind, name, listener)
+
+def _queue_pool_gauges(pool):
+    return {
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0)
+    }
+
+def pool_stats():
+    pool = engine.pool
+    # Cumulative since process start; the gauges below are instantaneous
+    stats = {
+        "mode": DB_POOL_MODE,
+        "checkouts": pool_wait_stats.checkouts,
+        "timeouts": pool_wait_stats.timeouts,
+        "wait_ms_total": round(pool_wait_stats.total_wait * 1000, 3),
+        "wait_ms_max": round(pool_wait_stats.max_wait * 1000, 3),
+        "wait_ms_avg": round(pool_wait_stats.total_wait * 1000 / pool_wait_stats.checkouts, 3) if pool_wait_stats.checkouts else 0.0,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(_queue_pool_gauges(pool))
+    # Checkout counters above include the async pool; its gauges are reported apart
+    if async_engine is not None and isinstance(async_engine.pool, QueuePool):
+        stats["async"] = _queue_pool_gauges(async_engine.pool)
+    return stats
+
+def warm_up_pool(size: int) -> int:
+    """Open up to `size` connections at once and return them to the pool, so the
+    first requests do not pay for connecting. No-op without a queue pool."""
+    if not isinstance(engine.pool, QueuePool) or size <= 0:
+        return 0
+    size = min(size, engine.pool.size())
+    # All held until every one is open, so each checkout creates a new connection
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        futures = [executor.submit(engine.raw_connection) for _ in range(size)]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    for future in futures:
+        if future.exception() is None:
+            future.result().close()
+    if errors:
+        raise errors[0]
+    return size
+
+async def warm_up_async_pool(size: int) -> int:
+    if async_engine is None or not isinstance(async_engine.pool, QueuePool) or size <= 0:
+        return 0
+    size = min(size, async_engine.pool.size())
+    connections = [async_engine.connect() for _ in range(size)]
+    results = await asyncio.gather(*(connection.start() for connection in connections), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    await asyncio.gather(*(connection.close() for connection, result in zip(connections, results) if result is connection))
+    if errors:
+        raise errors[0]
+    return size
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -35,3 +232,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database stack is disabled (set DB_ASYNC=true)")
+    async with AsyncSessionLocal() as db:
+        yield db
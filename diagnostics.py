@@ -0,0 +1,198 @@
+"""
+Opt-in SQL diagnostics (SQL_DIAGNOSTICS=true), to find slow statements and N+1 patterns.
+
+- Statements slower than SLOW_QUERY_MS are printed with their bound parameters and route.
+- A request that runs the same normalized statement (literals and parameters
+  replaced by ?) more than NPLUS1_THRESHOLD times is flagged when it ends.
+- With EXPLAIN_FILE set, each offending statement is re-run once per process under
+  EXPLAIN (ANALYZE, BUFFERS) after the response was sent, in a read-only transaction
+  that is rolled back, and the plan is appended to that file as a JSON line.
+
+Parameters whose name looks like a secret are masked, the others are printed as-is:
+leave this off in production unless investigating.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from database import engine, instrument_engines
+
+SQL_DIAGNOSTICS = os.getenv("SQL_DIAGNOSTICS", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+NPLUS1_THRESHOLD = int(os.getenv("NPLUS1_THRESHOLD", "10"))
+EXPLAIN_FILE = os.getenv("EXPLAIN_FILE") or None
+
+MAX_PARAMETER_LENGTH = 200
+_SECRET_PARAMETER = re.compile(r"key|password|token|secret|senha", re.IGNORECASE)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+# EXPLAIN ANALYZE runs the statement: only plain reads are captured
+_READ_ONLY = re.compile(r"^\s*select\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def normalize(statement: str) -> str:
+    sql = _STRING.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    # IN lists of any length look the same
+    sql = _LIST.sub("?, ...", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def format_parameters(parameters):
+    def value(name, v):
+        if name is not None and _SECRET_PARAMETER.search(str(name)):
+            return "***"
+        text = repr(v)
+        return text if len(text) <= MAX_PARAMETER_LENGTH else text[:MAX_PARAMETER_LENGTH] + "..."
+
+    if isinstance(parameters, dict):
+        return {name: value(name, v) for name, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [value(None, v) for v in parameters]
+    return parameters
+
+
+class RequestDiagnostics:
+    def __init__(self, scope):
+        self.scope = scope
+        self._lock = threading.Lock()
+        # normalized SQL -> [executions, total seconds, first (statement, parameters, executemany, bind)]
+        self.statements = {}
+        # (reason, normalized SQL, seconds, sample) to EXPLAIN once the response is sent
+        self.offenders = []
+
+    @property
+    def where(self) -> str:
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {route.path_format if route is not None else self.scope['path']}"
+
+    def record(self, normalized, elapsed, sample):
+        with self._lock:
+            entry = self.statements.get(normalized)
+            if entry is None:
+                self.statements[normalized] = [1, elapsed, sample]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def repeated(self, threshold):
+        with self._lock:
+            return [(sql, count, total, sample) for sql, (count, total, sample) in self.statements.items() if count > threshold]
+
+
+_current: ContextVar[Optional[RequestDiagnostics]] = ContextVar("sql_diagnostics", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._diagnostics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_diagnostics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    request = _current.get()
+    normalized = normalize(statement)
+    sample = (statement, parameters, executemany, conn.engine)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        where = request.where if request is not None else "outside a request"
+        print(f"⚠ Slow query ({elapsed * 1000:.0f} ms, {where}):\n{statement}\nparams: {format_parameters(parameters)}")
+        if request is not None:
+            request.offenders.append(("slow", normalized, elapsed, sample))
+    if request is not None:
+        request.record(normalized, elapsed, sample)
+
+
+ENGINE_LISTENERS = {
+    "before_cursor_execute": _before_cursor_execute,
+    "after_cursor_execute": _after_cursor_execute,
+}
+
+
+_explained = set()
+_explain_lock = threading.Lock()
+
+
+def explain(statement, parameters):
+    """EXPLAIN (ANALYZE, BUFFERS) of a psycopg2 statement, in a rolled back read-only transaction."""
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0]
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+def capture_plans(request: RequestDiagnostics, offenders):
+    for reason, normalized, seconds, (statement, parameters, executemany, bind) in offenders:
+        with _explain_lock:
+            if normalized in _explained:
+                continue
+            _explained.add(normalized)
+        # Plans are only re-run through the psycopg2 engine (asyncpg uses another parameter style)
+        if executemany or bind is not engine or not _READ_ONLY.match(statement):
+            continue
+        try:
+            plan = explain(statement, parameters)
+        except Exception as e:
+            print(f"⚠ EXPLAIN failed for {request.where}: {e}")
+            continue
+        line = {
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "reason": reason,
+            "route": request.where,
+            "duration_ms": round(seconds * 1000, 1),
+            "statement": statement,
+            "parameters": format_parameters(parameters),
+            "plan": plan
+        }
+        with _explain_lock:
+            with open(EXPLAIN_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, default=str) + "\n")
+        print(f"✓ Plan of {reason} statement on {request.where} written to {EXPLAIN_FILE}")
+
+
+class DiagnosticsMiddleware:
+    """Pure ASGI middleware: collects the statements of each request for the N+1 check."""
+
+    def __init__(self, app):
+        self.app = app
+        instrument_engines(ENGINE_LISTENERS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestDiagnostics(scope)
+        token = _current.set(request)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            for normalized, count, total, sample in request.repeated(NPLUS1_THRESHOLD):
+                print(f"⚠ Possible N+1 on {request.where}: {count} executions, {total * 1000:.0f} ms total:\n{normalized}")
+                request.offenders.append(("n+1", normalized, total, sample))
+            if EXPLAIN_FILE and request.offenders:
+                # After the last body chunk: the client is not kept waiting
+                await run_in_threadpool(capture_plans, request, request.offenders)
@@ -0,0 +1,247 @@
+"""
+Streaming spreadsheet exports.
+
+Rows are pulled from a server-side cursor and written straight into the
+response body, so memory stays flat whatever the number of rows and the
+client starts receiving bytes before the query has finished.
+"""
+import csv
+import io
+import re
+import time
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from database import SessionLocal
+from metrics import add_db_time
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = 1000
+# Rows written between two flushes of the response body
+FLUSH_EVERY_ROWS = 500
+
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+# Control characters are not allowed in XML 1.0 documents
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Cell style indexes (see _STYLES_XML)
+_STYLE_DATE = 1
+_STYLE_DATETIME = 2
+
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{title}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+# Built-in number formats: 14 = short date, 22 = date + time (both follow the reader's locale)
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+).encode("utf-8")
+_SHEET_TAIL = b'</sheetData></worksheet>'
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that buffers bytes until drained.
+
+    zipfile falls back to data descriptors when the target cannot seek, which
+    is what allows the archive to be sent while it is still being written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _excel_serial(value):
+    if isinstance(value, datetime):
+        # Excel has no notion of timezones
+        if value.tzinfo:
+            value = value.replace(tzinfo=None)
+        delta = value - _EXCEL_EPOCH
+    else:
+        delta = datetime.combine(value, datetime.min.time()) - _EXCEL_EPOCH
+    return delta.days + delta.seconds / 86400 + delta.microseconds / 86400e6
+
+
+def _cell_xml(ref, value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        return f'<c r="{ref}" s="{_STYLE_DATETIME}"><v>{_excel_serial(value)!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{_STYLE_DATE}"><v>{_excel_serial(value)!r}</v></c>'
+    text = _ILLEGAL_XML_CHARS.sub("", str(value))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def iter_xlsx(headers, rows, sheet_title="Sheet1"):
+    """Yield an .xlsx file chunk by chunk from an iterable of row sequences."""
+    columns = [_column_letter(i) for i in range(len(headers))]
+
+    def row_xml(number, values):
+        cells = "".join(
+            _cell_xml(f"{columns[i]}{number}", value)
+            for i, value in enumerate(values)
+        )
+        return f'<row r="{number}">{cells}</row>'.encode("utf-8")
+
+    title = escape(_ILLEGAL_XML_CHARS.sub("", sheet_title)[:31], {'"': "&quot;"})
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES_XML)
+        archive.writestr("_rels/.rels", _ROOT_RELS_XML)
+        archive.writestr("xl/workbook.xml", _WORKBOOK_XML.format(title=title))
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS_XML)
+        archive.writestr("xl/styles.xml", _STYLES_XML)
+        # First bytes go out before the query is even executed
+        yield sink.drain()
+
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(_SHEET_HEAD)
+            sheet.write(row_xml(1, headers))
+            for number, values in enumerate(rows, start=2):
+                sheet.write(row_xml(number, values))
+                if number % FLUSH_EVERY_ROWS == 0:
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            sheet.write(_SHEET_TAIL)
+    yield sink.drain()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%d/%m/%Y")
+    return value
+
+
+def iter_csv(headers, rows, delimiter=";"):
+    """Yield a CSV file chunk by chunk from an iterable of row sequences.
+
+    Uses ';' and a UTF-8 BOM so Excel (pt-BR) opens it with the right columns and accents.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\r\n")
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data.encode("utf-8")
+
+    writer.writerow(headers)
+    yield b"\xef\xbb\xbf" + drain()
+
+    for number, values in enumerate(rows, start=1):
+        writer.writerow([_csv_value(value) for value in values])
+        if number % FLUSH_EVERY_ROWS == 0:
+            yield drain()
+    tail = drain()
+    if tail:
+        yield tail
+
+
+def stream_rows(stmt, batch_size=STREAM_BATCH_SIZE):
+    """Iterate a select() through a server-side cursor.
+
+    The generator owns its session: StreamingResponse bodies are consumed
+    after the request dependencies (and their sessions) have been closed.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=batch_size))
+        partitions = result.partitions()
+        while True:
+            # Fetches from a named cursor are not cursor executions: timed here for /metrics
+            started = time.perf_counter()
+            rows = next(partitions, None)
+            add_db_time(time.perf_counter() - started)
+            if rows is None:
+                break
+            yield from rows
+    finally:
+        db.close()
@@ -0,0 +1,179 @@
+"""
+Spreadsheet ingestion for carteirinha uploads.
+
+Files are read incrementally (openpyxl read-only mode for .xlsx, a line
+reader for .csv) and processed in fixed-size chunks, one column at a time,
+so parse time and memory grow linearly with the number of rows.
+"""
+import csv
+import math
+import re
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import List, Optional, Tuple
+
+# Rows converted per chunk
+CHUNK_ROWS = 5000
+
+CARTEIRINHA_LENGTH = 21
+# Format: 0064.8000.400948.00-5 (dots at 4, 9 and 16, dash at 19)
+CARTEIRINHA_MASK = re.compile(r".{4}\..{4}\..{6}\..{2}-.", re.DOTALL)
+
+COLUMN_MAPPING = {
+    'carteiras': 'Carteirinha',
+    'Carteiras': 'Carteirinha',
+    'carteirinha': 'Carteirinha',
+    'Carteirinha': 'Carteirinha',
+    'PACIENTE': 'Paciente',
+    'paciente': 'Paciente',
+    'Paciente': 'Paciente',
+    'ID': 'IdPaciente',
+    'id': 'IdPaciente',
+    'IdPaciente': 'IdPaciente',
+    'id_paciente': 'IdPaciente',
+    'IdPagamento': 'IdPagamento',
+    'id_pagamento': 'IdPagamento',
+    'IDPAGAMENTO': 'IdPagamento'
+}
+
+
+class IngestionError(ValueError):
+    """The file cannot be ingested at all (unreadable, missing columns...)."""
+
+
+@dataclass
+class ParsedUpload:
+    items: List[dict] = field(default_factory=list)
+    # (line number, message), line 1 being the header
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+
+def carteirinha_format_error(code: str) -> Optional[str]:
+    if len(code) != CARTEIRINHA_LENGTH:
+        return f"Carteirinha inválida: {code}. Deve conter exatamente 21 caracteres."
+    if not CARTEIRINHA_MASK.fullmatch(code):
+        return f"Carteirinha inválida: {code}. Formato incorreto de pontos e traços. Esperado: 0000.0000.000000.00-0"
+    return None
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and math.isnan(value):
+        return ""
+    text = str(value).strip()
+    return "" if text.lower() == "nan" else text
+
+
+def _to_int(value) -> Optional[int]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(value)  # float first to handle "123.0"
+    except (ValueError, TypeError):
+        return None
+    if not math.isfinite(number):
+        return None
+    return int(number)
+
+
+def _column(records, index):
+    if index is None:
+        return [None] * len(records)
+    return [values[index] if index < len(values) else None for values in records]
+
+
+def _iter_xlsx_rows(fileobj):
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception as e:
+        raise IngestionError(f"Não foi possível ler o arquivo Excel: {e}")
+    try:
+        sheet = workbook.active
+        for line, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+            yield line, values
+    finally:
+        workbook.close()
+
+
+def _decoded_lines(fileobj):
+    first = True
+    for raw in fileobj:
+        try:
+            line = raw.decode('utf-8-sig' if first else 'utf-8')
+        except UnicodeDecodeError:
+            line = raw.decode('latin1')
+        first = False
+        yield line
+
+
+def _iter_csv_rows(fileobj):
+    lines = _decoded_lines(fileobj)
+    header_line = next(lines, None)
+    if header_line is None:
+        return
+    # Same rule as before: ';' unless it leaves a single column, then ','
+    delimiter = ';' if len(next(csv.reader([header_line], delimiter=';'))) > 1 else ','
+
+    def all_lines():
+        yield header_line
+        yield from lines
+
+    reader = csv.reader(all_lines(), delimiter=delimiter)
+    for values in reader:
+        yield reader.line_num, values
+
+
+def _process_chunk(chunk, indexes, result: ParsedUpload):
+    lines = [line for line, _ in chunk]
+    records = [values for _, values in chunk]
+
+    carteirinhas = list(map(_to_text, _column(records, indexes.get('Carteirinha'))))
+    pacientes = list(map(_to_text, _column(records, indexes.get('Paciente'))))
+    ids_paciente = list(map(_to_int, _column(records, indexes.get('IdPaciente'))))
+    ids_pagamento = list(map(_to_int, _column(records, indexes.get('IdPagamento'))))
+    format_errors = [carteirinha_format_error(code) if code else None for code in carteirinhas]
+
+    for i, code in enumerate(carteirinhas):
+        if not code:
+            continue
+        if format_errors[i]:
+            result.errors.append((lines[i], format_errors[i]))
+            continue
+        result.items.append({
+            "carteirinha": code,
+            "paciente": pacientes[i],
+            "id_paciente": ids_paciente[i],
+            "id_pagamento": ids_pagamento[i]
+        })
+
+
+def parse_carteirinhas_upload(fileobj, filename: str) -> ParsedUpload:
+    """Parse an uploaded .csv/.xlsx file (binary file object) into carteirinha rows."""
+    if filename and filename.lower().endswith('.csv'):
+        rows = _iter_csv_rows(fileobj)
+    else:
+        rows = _iter_xlsx_rows(fileobj)
+
+    first = next(rows, None)
+    header = [_to_text(name) for name in first[1]] if first else []
+    indexes = {}
+    for index, name in enumerate(header):
+        canonical = COLUMN_MAPPING.get(name, name)
+        indexes.setdefault(canonical, index)
+
+    if 'Carteirinha' not in indexes:
+        rows.close()
+        raise IngestionError(f"Excel/CSV must contain 'Carteirinha' or 'carteiras' column. Found: {header}")
+
+    result = ParsedUpload()
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        _process_chunk(chunk, indexes, result)
+    return result
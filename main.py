@@ -1,33 +1,127 @@
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
+from fastapi.routing import APIRoute
 # Trigger Redeploy
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
-from routes import auth, carteirinhas, jobs, guias, logs, dashboard
+from fastapi.responses import ORJSONResponse
+from database import DB_ASYNC, engine, async_engine, warm_up_pool, warm_up_async_pool
+import diagnostics
+import metrics
+from security import AUTH_REQUIRED, get_current_user, get_current_user_async
+from routes import auth, carteirinhas, jobs, guias, logs, dashboard, system
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Schema is managed by migrate_runner.py (migrations/*.sql), not at startup.
+# Startup does not touch the database unless asked to:
+# SCHEMA_CHECK: "warn" reports pending / modified migrations, "strict" refuses to start
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "").lower()
+# Connections opened per pool before serving (capped at DB_POOL_SIZE, queue pool only)
+POOL_WARMUP = int(os.getenv("POOL_WARMUP", "0"))
 
-app = FastAPI(title="Base Guias Unimed API", version="1.0.0")
+def check_schema():
+    # Imported here: only needed when the check is enabled
+    from migrate_runner import schema_drift
 
-# Configure CORS - Allow all origins for now
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Permite qualquer origem
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    with engine.connect() as connection:
+        pending, modified = schema_drift(connection)
+    problems = []
+    if pending:
+        problems.append(f"pending migrations: {', '.join(pending)}")
+    if modified:
+        problems.append(f"modified after being applied: {', '.join(modified)}")
+    if not problems:
+        print("✓ Schema up to date")
+        return
+    if SCHEMA_CHECK == "strict":
+        raise RuntimeError(f"Schema check failed: {'; '.join(problems)}")
+    print(f"⚠ Schema check: {'; '.join(problems)}")
+
+async def warm_up_pools():
+    try:
+        opened = await run_in_threadpool(warm_up_pool, POOL_WARMUP)
+        if DB_ASYNC:
+            opened += await warm_up_async_pool(POOL_WARMUP)
+        print(f"✓ Pool warm-up: {opened} connections")
+    except Exception as e:
+        # Best effort: requests will connect on demand
+        print(f"⚠ Pool warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SCHEMA_CHECK and SCHEMA_CHECK not in ("0", "false", "no", "off"):
+        await run_in_threadpool(check_schema)
+    if POOL_WARMUP > 0:
+        await warm_up_pools()
+    yield
+    engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
-@app.get("/")
 def read_root():
     return {"message": "Base Guias Unimed API is running"}
 
-# Include routers
-app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(carteirinhas.router)
-app.include_router(jobs.router)
-app.include_router(guias.router)
-app.include_router(logs.router, prefix="/api/logs")
-app.include_router(dashboard.router)
-from routes import pei
-app.include_router(pei.router)
+def drop_shadowed_routes(app: FastAPI):
+    """Keeps only the first route registered for each path and method set: the later
+    ones are never reached, and would duplicate paths and operation ids in the OpenAPI schema."""
+    seen = set()
+    routes = []
+    for route in app.router.routes:
+        if isinstance(route, APIRoute):
+            key = (route.path, frozenset(route.methods))
+            if key in seen:
+                continue
+            seen.add(key)
+        routes.append(route)
+    app.router.routes[:] = routes
+
+def create_app() -> FastAPI:
+    app = FastAPI(
+        title="Base Guias Unimed API",
+        version="1.0.0",
+        lifespan=lifespan,
+        # orjson renders the (already validated) response content much faster than json
+        default_response_class=ORJSONResponse
+    )
+
+    # Configure CORS - Allow all origins for now
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Permite qualquer origem
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if diagnostics.SQL_DIAGNOSTICS:
+        app.add_middleware(diagnostics.DiagnosticsMiddleware)
+    # Outermost: times the whole request, including the middleware above
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    app.get("/")(read_root)
+
+    # Every router except /auth requires a bearer key when AUTH_REQUIRED is set
+    protected = [Depends(get_current_user)] if AUTH_REQUIRED else []
+
+    # Include routers
+    if DB_ASYNC:
+        # Registered first: takes over the hot read endpoints from the sync routers below
+        from routes import async_api
+        async_protected = [Depends(get_current_user_async)] if AUTH_REQUIRED else []
+        app.include_router(async_api.router, dependencies=async_protected)
+    app.include_router(auth.router, prefix="/auth", tags=["auth"])
+    app.include_router(carteirinhas.router, dependencies=protected)
+    app.include_router(jobs.router, dependencies=protected)
+    app.include_router(guias.router, dependencies=protected)
+    app.include_router(logs.router, prefix="/api/logs", dependencies=protected)
+    app.include_router(dashboard.router, dependencies=protected)
+    from routes import pei
+    app.include_router(pei.router, dependencies=protected)
+    app.include_router(system.router, dependencies=protected)
+    app.include_router(metrics.router, dependencies=protected)
+    if DB_ASYNC:
+        # The sync handlers replaced by async_api
+        drop_shadowed_routes(app)
+    return app
+
+# uvicorn main:app (or uvicorn --factory main:create_app)
+app = create_app()
@@ -0,0 +1,237 @@
+"""
+Request metrics, exposed in the Prometheus text format at /metrics.
+
+MetricsMiddleware times every request and SQLAlchemy cursor hooks add each
+statement's time to the request being served (a contextvar, so threadpool
+handlers, async sessions and streamed bodies are all attributed correctly).
+Per route: latency, SQL statements, DB time and response size histograms.
+Each response also gets `app` and `db` entries in its Server-Timing header,
+measured up to the moment the response starts (streamed bodies come after).
+
+Values are kept per process: with several uvicorn workers each one reports its own.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from database import instrument_engines, pool_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 500)
+SIZE_BUCKETS = (256, 1024, 10_240, 102_400, 1_048_576, 10_485_760, 104_857_600)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets, labels=("method", "route", "status")):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._lock = threading.Lock()
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, label_values: tuple, value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {values[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {values[-1]}")
+        return lines
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Time from request to the end of the response body", LATENCY_BUCKETS
+)
+request_statements = Histogram(
+    "http_request_db_statements", "SQL statements executed per request", STATEMENT_BUCKETS
+)
+request_db_time = Histogram(
+    "http_request_db_duration_seconds", "Time spent executing SQL and fetching rows per request", LATENCY_BUCKETS
+)
+response_size = Histogram(
+    "http_response_size_bytes", "Response body size", SIZE_BUCKETS
+)
+HISTOGRAMS = [request_latency, request_statements, request_db_time, response_size]
+
+
+# SQLAlchemy hooks: start times are kept on the connection; a statement that fails
+# never reaches after_cursor_execute and is closed by handle_error instead
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_statement(conn)
+
+
+def _handle_error(exception_context):
+    if exception_context.connection is not None:
+        _record_statement(exception_context.connection)
+
+
+def _record_statement(conn):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+def add_db_time(seconds: float):
+    """DB time spent outside cursor executions (server-side cursor fetches)."""
+    stats = _current.get()
+    if stats is not None:
+        stats.db_time += seconds
+
+
+ENGINE_LISTENERS = {
+    "before_cursor_execute": _before_cursor_execute,
+    "after_cursor_execute": _after_cursor_execute,
+    "handle_error": _handle_error,
+}
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware: streamed bodies pass through untouched)."""
+
+    def __init__(self, app):
+        self.app = app
+        instrument_engines(ENGINE_LISTENERS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                timing = f'app;dur={elapsed_ms:.1f}, db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} queries"'
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"server-timing"]
+                existing = [v for k, v in message.get("headers", []) if k.lower() == b"server-timing"]
+                # Appended to what the endpoint already reports (e.g. /pei/dashboard cache hit or miss)
+                headers.append((b"server-timing", b", ".join(existing + [timing.encode("latin-1")])))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            # The route template, never the raw path, to keep the label set bounded
+            labels = (scope["method"], route.path_format if route is not None else "unmatched", str(status))
+            request_latency.observe(labels, time.perf_counter() - started)
+            request_statements.observe(labels, stats.statements)
+            request_db_time.observe(labels, stats.db_time)
+            response_size.observe(labels, size)
+
+
+def _pool_lines():
+    stats = pool_stats()
+    lines = [
+        "# HELP db_pool_checkouts_total Connection checkouts",
+        "# TYPE db_pool_checkouts_total counter",
+        f"db_pool_checkouts_total {stats['checkouts']}",
+        "# HELP db_pool_timeouts_total Checkouts that timed out waiting for a connection",
+        "# TYPE db_pool_timeouts_total counter",
+        f"db_pool_timeouts_total {stats['timeouts']}",
+        "# HELP db_pool_wait_seconds_total Time spent waiting for a connection",
+        "# TYPE db_pool_wait_seconds_total counter",
+        f"db_pool_wait_seconds_total {stats['wait_ms_total'] / 1000:.6f}",
+    ]
+    # Queue pools only (DB_POOL_MODE=queue); the async pool is labelled apart
+    pools = []
+    if "size" in stats:
+        pools.append(("sync", stats))
+    if "async" in stats:
+        pools.append(("async", stats["async"]))
+    for gauge, description in (
+        ("size", "Configured pool size"),
+        ("checked_out", "Connections in use"),
+        ("checked_in", "Idle connections in the pool"),
+        ("overflow", "Connections open beyond the pool size"),
+    ):
+        if pools:
+            lines.append(f"# HELP db_pool_{gauge} {description}")
+            lines.append(f"# TYPE db_pool_{gauge} gauge")
+        for name, values in pools:
+            lines.append(f'db_pool_{gauge}{{pool="{name}"}} {values[gauge]}')
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(_pool_lines())
+    lines.extend([
+        "# HELP process_cpu_seconds_total CPU time used by this process",
+        "# TYPE process_cpu_seconds_total counter",
+        f"process_cpu_seconds_total {time.process_time():.6f}",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter(tags=["System"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
@@ -1,34 +1,217 @@
+"""
+Applies migrations/*.sql in order, each one once.
+
+Applied files are recorded in schema_migrations with a checksum; editing a file
+that was already applied is an error (add a new migration instead). Each file
+runs in its own transaction together with its schema_migrations row. A file
+containing the line `-- migrate: no-transaction` (CREATE INDEX CONCURRENTLY,
+...) runs statement by statement in autocommit mode; its statements must end
+with `;` at the end of a line and should be idempotent (IF NOT EXISTS).
+
+    python migrate_runner.py                   # apply pending migrations
+    python migrate_runner.py --status
+    python migrate_runner.py --baseline 0009   # existing database: record 0001..0009 as applied, without running them
+
+Run it against a direct / session-mode connection (MIGRATIONS_DATABASE_URL),
+not the transaction pooler.
+"""
+import argparse
+import hashlib
 import os
 import sys
-from sqlalchemy import text
-from database import engine
+import time
+from dataclasses import dataclass
 
-def run_migrations():
-    print("Running migrations...")
-    migrations_dir = os.path.join(os.path.dirname(__file__), "migrations")
-    
-    # Order matters: 0001 then 0002
-    files = sorted([f for f in os.listdir(migrations_dir) if f.endswith(".sql")])
-    
-    with engine.connect() as connection:
-        for file in files:
-            print(f"Executing {file}...")
-            with open(os.path.join(migrations_dir, file), "r", encoding="utf-8") as f:
-                sql = f.read()
-                # Split by statement if needed, or execute block. 
-                # Simple SQL files usually can be executed as one block if supported, 
-                # but SQLAlchemy text() might prefer single statements or BEGIN/COMMIT blocks.
-                # Let's try executing the whole file content.
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from database import SQLALCHEMY_DATABASE_URL
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATIONS_DATABASE_URL = os.getenv("MIGRATIONS_DATABASE_URL") or SQLALCHEMY_DATABASE_URL
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+# pg_advisory_lock key: one runner at a time (e.g. several instances deploying at once)
+LOCK_KEY = 48062026
+
+class MigrationError(Exception):
+    pass
+
+@dataclass
+class Migration:
+    version: str
+    filename: str
+    sql: str
+    checksum: str
+    no_transaction: bool
+
+def load_migrations():
+    migrations = []
+    for filename in sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql")):
+        with open(os.path.join(MIGRATIONS_DIR, filename), "r", encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append(Migration(
+            version=filename.split("_", 1)[0],
+            filename=filename,
+            sql=sql,
+            checksum=hashlib.sha256(sql.encode("utf-8")).hexdigest(),
+            no_transaction=any(line.strip() == NO_TRANSACTION_MARKER for line in sql.splitlines())
+        ))
+    return migrations
+
+def split_statements(sql: str):
+    """Statements of a no-transaction file: each one ends with `;` at the end of a line."""
+    statements, current = [], []
+    for line in sql.splitlines():
+        if not current and (not line.strip() or line.strip().startswith("--")):
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current))
+            current = []
+    if current:
+        statements.append("\n".join(current))
+    return statements
+
+def execute_script(connection, sql: str):
+    # Straight to the driver cursor, without parameters: SQL files may contain
+    # % and :name sequences (format() calls, casts) that must not be interpreted
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(sql)
+    finally:
+        cursor.close()
+
+def ensure_history_table(connection):
+    connection.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            duration_ms INTEGER
+        )
+    """)
+
+def applied_migrations(connection):
+    rows = connection.execute(text("SELECT version, filename, checksum FROM schema_migrations"))
+    return {row.version: row for row in rows}
+
+def schema_drift(connection):
+    """(pending, modified) migration filenames; read-only, for the app's startup check."""
+    migrations = load_migrations()
+    if not connection.execute(text("SELECT to_regclass('schema_migrations') IS NOT NULL")).scalar():
+        return [m.filename for m in migrations], []
+    applied = applied_migrations(connection)
+    pending = [m.filename for m in migrations if m.version not in applied]
+    modified = [m.filename for m in migrations if m.version in applied and applied[m.version].checksum != m.checksum]
+    return pending, modified
+
+def record(connection, migration: Migration, duration_ms=None):
+    connection.execute(
+        text(
+            "INSERT INTO schema_migrations (version, filename, checksum, duration_ms) "
+            "VALUES (:version, :filename, :checksum, :duration_ms)"
+        ),
+        {"version": migration.version, "filename": migration.filename,
+         "checksum": migration.checksum, "duration_ms": duration_ms}
+    )
+
+def apply(engine, migration: Migration):
+    started = time.perf_counter()
+    if migration.no_transaction:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            for statement in split_statements(migration.sql):
                 try:
-                    connection.execute(text(sql))
-                    connection.commit()
-                    print(f"Finished {file}")
-                except Exception as e:
-                    print(f"Error executing {file}: {e}")
-                    # Don't break immediately, or do?
-                    # connection.rollback() is automatic on error context usually, but we are explicit.
-                    
+                    execute_script(connection, statement)
+                except Exception:
+                    # A failed CREATE INDEX CONCURRENTLY leaves an invalid index that IF NOT EXISTS would skip
+                    invalid = connection.exec_driver_sql(
+                        "SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid"
+                    ).scalars().all()
+                    if invalid:
+                        print(f"Invalid indexes left behind, drop them before retrying: {', '.join(invalid)}")
+                    raise
+        with engine.begin() as connection:
+            record(connection, migration, int((time.perf_counter() - started) * 1000))
+    else:
+        with engine.begin() as connection:
+            execute_script(connection, migration.sql)
+            record(connection, migration, int((time.perf_counter() - started) * 1000))
+    return time.perf_counter() - started
+
+def run_migrations(baseline=None):
+    print("Running migrations...")
+    migrations = load_migrations()
+    # No statement_timeout / pooler settings from the app engine here
+    engine = create_engine(MIGRATIONS_DATABASE_URL, poolclass=NullPool)
+
+    # Autocommit: an open transaction on this connection would block CREATE INDEX CONCURRENTLY
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+        lock_connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        try:
+            with engine.begin() as connection:
+                ensure_history_table(connection)
+                applied = applied_migrations(connection)
+                existing_schema = connection.execute(text("SELECT to_regclass('carteirinhas') IS NOT NULL")).scalar()
+
+            changed = [m.filename for m in migrations if m.version in applied and applied[m.version].checksum != m.checksum]
+            if changed:
+                raise MigrationError(f"Applied migrations were modified: {', '.join(changed)}")
+
+            if baseline:
+                with engine.begin() as connection:
+                    for migration in migrations:
+                        if migration.version <= baseline and migration.version not in applied:
+                            record(connection, migration)
+                            print(f"Baselined {migration.filename}")
+                applied = {m.version for m in migrations if m.version <= baseline} | set(applied)
+            elif not applied and existing_schema:
+                raise MigrationError(
+                    "Database already has tables but no migration history: "
+                    "run with --baseline <last version already applied>"
+                )
+
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+                print(f"Executing {migration.filename}...")
+                elapsed = apply(engine, migration)
+                print(f"Finished {migration.filename} ({elapsed:.1f}s)")
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+
     print("Migrations completed.")
 
+def print_status():
+    engine = create_engine(MIGRATIONS_DATABASE_URL, poolclass=NullPool)
+    with engine.begin() as connection:
+        ensure_history_table(connection)
+        applied = {
+            row.version: row for row in connection.execute(
+                text("SELECT version, checksum, applied_at, duration_ms FROM schema_migrations")
+            )
+        }
+    for migration in load_migrations():
+        row = applied.get(migration.version)
+        if row is None:
+            state = "pending"
+        elif row.checksum != migration.checksum:
+            state = "MODIFIED after being applied"
+        else:
+            state = f"applied {row.applied_at:%Y-%m-%d %H:%M}" + (f" ({row.duration_ms} ms)" if row.duration_ms is not None else " (baseline)")
+        print(f"{migration.filename}: {state}")
+
 if __name__ == "__main__":
-    run_migrations()
+    parser = argparse.ArgumentParser(description="Apply pending SQL migrations")
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they were applied")
+    parser.add_argument("--baseline", metavar="VERSION", help="record migrations up to VERSION as applied without running them")
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            print_status()
+        else:
+            run_migrations(baseline=args.baseline)
+    except MigrationError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
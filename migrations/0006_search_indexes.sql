@@ -0,0 +1,23 @@
+-- Migration 0006: Trigram indexes for patient / carteirinha / therapy search
+-- Date: 2026-10-18
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() is only STABLE, so it cannot be used in an index expression.
+-- This wrapper pins the dictionary and is declared IMMUTABLE.
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT unaccent('unaccent'::regdictionary, $1) $$;
+
+-- Accent- and case-insensitive patient name search (LIKE '%term%' and word_similarity)
+CREATE INDEX IF NOT EXISTS idx_carteirinhas_paciente_trgm
+ON carteirinhas USING gin (f_unaccent(lower(paciente)) gin_trgm_ops);
+
+-- Partial card number search
+CREATE INDEX IF NOT EXISTS idx_carteirinhas_carteirinha_trgm
+ON carteirinhas USING gin (carteirinha gin_trgm_ops);
+
+-- Therapy code search in the PEI list
+CREATE INDEX IF NOT EXISTS idx_patient_pei_codigo_terapia_trgm
+ON patient_pei USING gin (lower(codigo_terapia) gin_trgm_ops);
@@ -0,0 +1,19 @@
+-- Migration 0007: One patient_pei row per (carteirinha_id, codigo_terapia)
+-- Date: 2026-10-18
+
+-- The set-based recompute upserts with ON CONFLICT on this pair.
+-- Keep the most recently updated row of any duplicated pair first.
+DELETE FROM patient_pei
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY carteirinha_id, codigo_terapia
+            ORDER BY updated_at DESC NULLS LAST, id DESC
+        ) AS rn
+        FROM patient_pei
+    ) ranked
+    WHERE rn > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_patient_pei_carteirinha_terapia
+ON patient_pei (carteirinha_id, codigo_terapia) NULLS NOT DISTINCT;
@@ -0,0 +1,93 @@
+-- Migration 0008: Monthly range partitions for logs (on created_at, UTC months)
+-- Date: 2026-10-18
+
+-- Creates the partition for the month containing `month`, if missing, and returns its name.
+-- Rows already routed to logs_default for that month are moved into it.
+-- Called by scripts/logs_retention.py to keep partitions ahead of time.
+CREATE OR REPLACE FUNCTION ensure_logs_partition(month date) RETURNS text
+    LANGUAGE plpgsql AS $$
+DECLARE
+    start_day date := date_trunc('month', month)::date;
+    partition_name text := 'logs_' || to_char(start_day, 'YYYY_MM');
+    start_at timestamptz := start_day::timestamp AT TIME ZONE 'UTC';
+    end_at timestamptz := (start_day + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    IF to_regclass('logs_default') IS NOT NULL
+       AND EXISTS (SELECT 1 FROM logs_default WHERE created_at >= start_at AND created_at < end_at) THEN
+        EXECUTE format('CREATE TABLE %I (LIKE logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM logs_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            start_at, end_at, partition_name
+        );
+        EXECUTE format('ALTER TABLE logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', partition_name, start_at, end_at);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)', partition_name, start_at, end_at);
+    END IF;
+    RETURN partition_name;
+END $$;
+
+DO $$
+DECLARE
+    seq text;
+    first_month timestamp;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('logs')) THEN
+        RETURN;
+    END IF;
+
+    IF to_regclass('logs') IS NOT NULL THEN
+        -- Keep the id sequence: it outlives the old table and keeps numbering
+        seq := pg_get_serial_sequence('logs', 'id');
+        ALTER TABLE logs RENAME TO logs_unpartitioned;
+        ALTER TABLE logs_unpartitioned RENAME CONSTRAINT logs_pkey TO logs_unpartitioned_pkey;
+        ALTER INDEX IF EXISTS ix_logs_id RENAME TO ix_logs_unpartitioned_id;
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+        SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC') INTO first_month FROM logs_unpartitioned;
+    ELSE
+        CREATE SEQUENCE IF NOT EXISTS logs_id_seq;
+        seq := 'logs_id_seq';
+    END IF;
+
+    -- The partition key must be part of the primary key
+    EXECUTE format($sql$
+        CREATE TABLE logs (
+            id INTEGER NOT NULL DEFAULT nextval(%L::regclass),
+            job_id INTEGER REFERENCES jobs(id) ON DELETE SET NULL,
+            carteirinha_id INTEGER REFERENCES carteirinhas(id) ON DELETE SET NULL,
+            level TEXT DEFAULT 'INFO',
+            message TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    $sql$, seq);
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY logs.id', seq);
+
+    -- Catches rows outside the monthly partitions (clock skew, a missed ensure run)
+    CREATE TABLE logs_default PARTITION OF logs DEFAULT;
+
+    -- Every month with existing rows, up to three months ahead
+    PERFORM ensure_logs_partition(month::date)
+    FROM generate_series(
+        coalesce(first_month, date_trunc('month', now() AT TIME ZONE 'UTC')),
+        date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+        interval '1 month'
+    ) AS month;
+
+    IF to_regclass('logs_unpartitioned') IS NOT NULL THEN
+        INSERT INTO logs (id, job_id, carteirinha_id, level, message, created_at)
+        SELECT id, job_id, carteirinha_id, level, message, coalesce(created_at, now())
+        FROM logs_unpartitioned;
+        DROP TABLE logs_unpartitioned;
+    END IF;
+END $$;
+
+-- Created on every partition: newest-first listing, the job filter, and the
+-- ON DELETE SET NULL lookups when a job or carteirinha is deleted
+CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_logs_job_id ON logs (job_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_logs_carteirinha_id ON logs (carteirinha_id);
@@ -0,0 +1,45 @@
+-- Migration 0009: One base_guias row per (carteirinha_id, guia)
+-- Date: 2026-10-18
+
+-- POST /guias/batch upserts on this natural key. Existing duplicates are merged
+-- into their most recently updated row. pei_temp and patient_pei are repointed
+-- first, because deleting a guia cascades to both. Run POST /pei/recompute afterwards.
+CREATE TEMP TABLE guia_duplicates ON COMMIT DROP AS
+SELECT id, keep_id FROM (
+    SELECT id, first_value(id) OVER (
+        PARTITION BY carteirinha_id, guia
+        ORDER BY updated_at DESC NULLS LAST, id DESC
+    ) AS keep_id
+    FROM base_guias
+    WHERE guia IS NOT NULL
+) ranked
+WHERE id <> keep_id;
+
+-- pei_temp allows one override per guia: keep the kept guia's own, else the newest one
+DELETE FROM pei_temp
+WHERE id IN (
+    SELECT id FROM (
+        SELECT t.id, row_number() OVER (
+            PARTITION BY g.keep_id
+            ORDER BY (t.base_guia_id = g.keep_id) DESC, t.updated_at DESC NULLS LAST, t.id DESC
+        ) AS rn
+        FROM pei_temp t
+        JOIN (
+            SELECT id, keep_id FROM guia_duplicates
+            UNION
+            SELECT keep_id, keep_id FROM guia_duplicates
+        ) g ON g.id = t.base_guia_id
+    ) ranked
+    WHERE rn > 1
+);
+
+UPDATE pei_temp t SET base_guia_id = d.keep_id
+FROM guia_duplicates d WHERE t.base_guia_id = d.id;
+
+UPDATE patient_pei p SET base_guia_id = d.keep_id
+FROM guia_duplicates d WHERE p.base_guia_id = d.id;
+
+DELETE FROM base_guias WHERE id IN (SELECT id FROM guia_duplicates);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_base_guias_carteirinha_guia
+ON base_guias (carteirinha_id, guia);
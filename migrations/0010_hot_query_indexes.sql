@@ -0,0 +1,31 @@
+-- Migration 0010: Indexes for the hot queries, built without blocking writes
+-- Date: 2026-10-18
+-- migrate: no-transaction
+
+-- Already covered elsewhere: logs(created_at) on every partition (0008, and a
+-- partitioned table cannot be indexed CONCURRENTLY), patient_pei
+-- (carteirinha_id, codigo_terapia) unique (0007), base_guias (carteirinha_id, guia) unique (0009).
+
+-- Job claim (status, then priority DESC, created_at) and the status filter of GET /jobs
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_status_priority
+ON jobs (status, priority DESC, created_at);
+
+-- GET /jobs order: priority DESC, created_at DESC, id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_priority_created
+ON jobs (priority, created_at, id);
+
+-- Latest guia per (carteirinha_id, codigo_terapia): DISTINCT ON in pei_engine
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_base_guias_pair_latest
+ON base_guias (carteirinha_id, codigo_terapia, data_autorizacao DESC, id DESC);
+
+-- Date filter of GET /guias and the changed_since PEI recompute
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_base_guias_updated_at
+ON base_guias (updated_at);
+
+-- GET /guias order: created_at DESC, id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_base_guias_created_at
+ON base_guias (created_at, id);
+
+-- GET /pei order: status, updated_at DESC, id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_pei_status_updated
+ON patient_pei (status, updated_at DESC, id DESC);
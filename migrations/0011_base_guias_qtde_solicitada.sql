@@ -0,0 +1,6 @@
+-- Migration 0011: base_guias.qtde_solicitada
+-- Date: 2026-10-18
+
+-- Used by the PEI rules; until now the column was only created by
+-- Base.metadata.create_all at startup, which no longer runs
+ALTER TABLE base_guias ADD COLUMN IF NOT EXISTS qtde_solicitada INTEGER;
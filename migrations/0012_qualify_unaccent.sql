@@ -0,0 +1,31 @@
+-- Migration 0012: Schema-qualified unaccent() in f_unaccent
+-- Date: 2026-10-18
+
+-- f_unaccent() (migration 0006) looked unaccent() and its dictionary up through the
+-- caller's search_path. On Supabase the extensions live in the "extensions" schema,
+-- which is not on the restricted search_path of dump/restore and of maintenance
+-- (autovacuum / ANALYZE / REINDEX evaluating the index expressions), so those failed.
+-- The body now names the schema unaccent is installed in. Results are unchanged, so
+-- the indexes built on it stay valid. Their gin_trgm_ops operator class needs no
+-- change: it is bound when the index is created, and pg_dump writes it qualified.
+DO $$
+DECLARE
+    unaccent_schema text;
+BEGIN
+    SELECT n.nspname INTO unaccent_schema
+    FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+    WHERE e.extname = 'unaccent';
+
+    IF unaccent_schema IS NULL THEN
+        RAISE EXCEPTION 'unaccent extension not installed (migration 0006)';
+    END IF;
+
+    EXECUTE format(
+        $sql$CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            AS $body$ SELECT %I.unaccent(%L::regdictionary, $1) $body$
+        $sql$,
+        unaccent_schema,
+        quote_ident(unaccent_schema) || '.unaccent'
+    );
+END $$;
@@ -0,0 +1,9 @@
+-- Migration 0013: Index for the GET /carteirinhas order, built without blocking writes
+-- Date: 2026-10-18
+-- migrate: no-transaction
+
+-- Patients without a name last, then name, then id: the sort key of GET /carteirinhas
+-- (routes/carteirinhas.py). Offset and cursor pages read it in order instead of
+-- sorting the whole table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_carteirinhas_paciente_sort
+ON carteirinhas ((paciente IS NULL), (coalesce(paciente, '')), id);
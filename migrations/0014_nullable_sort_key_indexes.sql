@@ -0,0 +1,15 @@
+-- Migration 0014: Indexes for the NULL-safe sort keys of GET /jobs and GET /pei
+-- Date: 2026-10-18
+-- migrate: no-transaction
+
+-- jobs.priority and patient_pei.status are nullable, so their sort keys
+-- (routes/jobs.py, routes/pei.py) order by (col IS NULL) and coalesce(col, ...)
+-- instead of the bare column. These indexes follow the new order.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_priority_sort
+ON jobs ((priority IS NULL), (coalesce(priority, 0)), created_at, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_pei_status_sort
+ON patient_pei ((status IS NULL), (coalesce(status, '')), updated_at DESC, id DESC);
+
+-- Only the GET /jobs order used it; idx_patient_pei_status_updated stays for the status filter
+DROP INDEX CONCURRENTLY IF EXISTS idx_jobs_priority_created;
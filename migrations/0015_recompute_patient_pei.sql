@@ -0,0 +1,49 @@
+-- Migration 0015: Recompute patient_pei after the guia merge of 0009
+-- Date: 2026-10-18
+
+-- 0009 merged duplicated guias and repointed patient_pei to the kept ones, but left
+-- the computed values as they were, and kept the rows of pairs whose guias all moved
+-- to another codigo_terapia. The merged pairs can no longer be told apart, so every
+-- pair is recomputed, with the rules of pei_engine.recompute_pei. Rows whose values
+-- do not change are left untouched (updated_at included).
+
+-- Pairs without any guia left (recompute_pei deletes these when scoped to pairs)
+DELETE FROM patient_pei p
+WHERE NOT EXISTS (
+    SELECT 1 FROM base_guias g
+    WHERE g.carteirinha_id = p.carteirinha_id
+      AND g.codigo_terapia IS NOT DISTINCT FROM p.codigo_terapia
+);
+
+-- The latest guia (data_autorizacao, then id) of every pair decides its row
+INSERT INTO patient_pei (carteirinha_id, codigo_terapia, base_guia_id, pei_semanal, validade, status)
+SELECT
+    latest.carteirinha_id,
+    latest.codigo_terapia,
+    latest.id,
+    CASE
+        WHEN t.id IS NOT NULL THEN t.pei_semanal
+        WHEN latest.qtde_solicitada != 0 THEN CAST(latest.qtde_solicitada AS FLOAT) / 16
+        ELSE 0.0
+    END,
+    latest.data_autorizacao + 180,
+    CASE
+        WHEN t.id IS NOT NULL THEN 'Validado'
+        WHEN latest.qtde_solicitada != 0 AND latest.qtde_solicitada % 16 = 0 THEN 'Validado'
+        ELSE 'Pendente'
+    END
+FROM (
+    SELECT DISTINCT ON (carteirinha_id, codigo_terapia)
+        id, carteirinha_id, codigo_terapia, data_autorizacao, qtde_solicitada
+    FROM base_guias
+    ORDER BY carteirinha_id, codigo_terapia, data_autorizacao DESC, id DESC
+) latest
+LEFT JOIN pei_temp t ON t.base_guia_id = latest.id
+ON CONFLICT (carteirinha_id, codigo_terapia) DO UPDATE SET
+    base_guia_id = excluded.base_guia_id,
+    pei_semanal = excluded.pei_semanal,
+    validade = excluded.validade,
+    status = excluded.status,
+    updated_at = now()
+WHERE (patient_pei.base_guia_id, patient_pei.pei_semanal, patient_pei.validade, patient_pei.status)
+    IS DISTINCT FROM (excluded.base_guia_id, excluded.pei_semanal, excluded.validade, excluded.status);
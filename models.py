@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Text, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -63,6 +63,11 @@ class BaseGuia(Base):
 
     carteirinha_rel = relationship("Carteirinha", back_populates="guias")
 
+    # Natural key, ON CONFLICT target of POST /guias/batch (migration 0009)
+    __table_args__ = (
+        Index("uq_base_guias_carteirinha_guia", "carteirinha_id", "guia", unique=True),
+    )
+
 class PeiTemp(Base):
     __tablename__ = "pei_temp"
 
@@ -89,6 +94,12 @@ class PatientPei(Base):
 
     carteirinha_rel = relationship("Carteirinha")
 
+    # ON CONFLICT target of the PEI recompute (migration 0007)
+    __table_args__ = (
+        Index("uq_patient_pei_carteirinha_terapia", "carteirinha_id", "codigo_terapia",
+              unique=True, postgresql_nulls_not_distinct=True),
+    )
+
 
 class Log(Base):
     __tablename__ = "logs"
@@ -98,7 +109,8 @@ class Log(Base):
     carteirinha_id = Column(Integer, ForeignKey("carteirinhas.id", ondelete="Set NULL"), nullable=True)
     level = Column(Text, default="INFO") # INFO, WARN, ERROR
     message = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Partition key: logs is range-partitioned by month (migration 0008)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     job_rel = relationship("Job", back_populates="logs")
     carteirinha_rel = relationship("Carteirinha", back_populates="logs")
@@ -0,0 +1,209 @@
+"""
+Offset and keyset (cursor) pagination for the list endpoints.
+
+A sort key is a list of (expression, descending) pairs ending with a unique
+column. In cursor mode the values of the last row's key are encoded into an
+opaque `next_cursor`, and the next page starts right after them with a
+WHERE clause instead of an OFFSET, so every page costs the same.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, func, literal, or_, select, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+COUNT_MODES = ("exact", "estimate", "none")
+
+CURSOR_DESCRIPTION = "Keyset pagination: send an empty value for the first page, then the returned next_cursor"
+COUNT_DESCRIPTION = "Total: exact | estimate (planner estimate) | none. Default: exact, or none with cursor"
+
+_KEY_LABEL = "_sort_key_{}"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _python_type(expr):
+    try:
+        return expr.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _check_type(value, expected):
+    # A well-formed cursor can still carry values of the wrong type, which Postgres
+    # would reject when comparing them with the sort key
+    if value is None or expected is None:
+        return
+    if isinstance(value, bool) and expected is not bool:
+        raise ValueError("wrong type")
+    if expected is float:
+        expected = (int, float)
+    if not isinstance(value, expected):
+        raise ValueError("wrong type")
+
+
+def decode_cursor(token: str, keys) -> list:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("wrong size")
+        values = [_decode_value(v) for v in values]
+        for value, (expr, _) in zip(values, keys):
+            _check_type(value, _python_type(expr))
+        return values
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+
+def keyset_condition(keys, values):
+    """Rows strictly after `values` in the order defined by `keys`."""
+    # Bound parameters: SQLAlchemy only allows =, != and IS with a bare True/False
+    values = [literal(value, expr.type) for (expr, _), value in zip(keys, values)]
+    directions = {descending for _, descending in keys}
+    if len(directions) == 1:
+        # Same direction everywhere: a row comparison, which can use a composite index
+        left = tuple_(*[expr for expr, _ in keys])
+        right = tuple_(*values)
+        first, value = keys[0][0], values[0]
+        # The redundant bound on the first column is what partition pruning can use
+        if directions.pop():
+            return and_(left < right, first <= value)
+        return and_(left > right, first >= value)
+
+    # Mixed directions: (a > x) OR (a = x AND b < y) OR ...
+    clauses = []
+    for i, (expr, descending) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        after = expr < values[i] if descending else expr > values[i]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def order_clauses(keys):
+    return [expr.desc() if descending else expr.asc() for expr, descending in keys]
+
+
+def page_statement(stmt, keys, limit: int, skip: int = 0, cursor_mode: bool = False, cursor_values=None):
+    """The page query: the sort key values are added as extra labelled columns
+    so the next cursor can be built from the last row, whatever is selected."""
+    stmt = stmt.add_columns(*[expr.label(_KEY_LABEL.format(i)) for i, (expr, _) in enumerate(keys)])
+    stmt = stmt.order_by(*order_clauses(keys))
+    if not cursor_mode:
+        return stmt.offset(skip).limit(limit)
+    if cursor_values is not None:
+        stmt = stmt.where(keyset_condition(keys, cursor_values))
+    # One extra row tells whether there is a next page
+    return stmt.limit(limit + 1)
+
+
+def finish_page(rows, keys, limit: int, cursor_mode: bool):
+    """Split the fetched rows into the page and the next cursor (cursor mode only)."""
+    if not cursor_mode:
+        return rows, None
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor([last[_KEY_LABEL.format(i)] for i in range(len(keys))])
+    return rows, next_cursor
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) <statement>, executable with any driver, sync or async."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def count_statement(stmt):
+    return select(func.count()).select_from(stmt.order_by(None).subquery())
+
+
+def plan_rows(explain_output) -> int:
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    return int(explain_output[0]["Plan"]["Plan Rows"])
+
+
+def resolve_count_mode(count, cursor_mode: bool) -> str:
+    # Offset pages keep the exact total by default; cursor pages skip it unless asked
+    mode = count or ("none" if cursor_mode else "exact")
+    if mode not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count deve ser um de: {', '.join(COUNT_MODES)}")
+    return mode
+
+
+def _prepare(stmt, keys, limit, skip, cursor, count):
+    cursor_mode = cursor is not None
+    count_mode = resolve_count_mode(count, cursor_mode)
+    cursor_values = decode_cursor(cursor, keys) if cursor else None
+    page = page_statement(stmt, keys, limit, skip, cursor_mode, cursor_values)
+
+    total_stmt = None
+    if count_mode == "exact":
+        total_stmt = count_statement(stmt)
+    elif count_mode == "estimate":
+        # The planner's row estimate for the filtered query replaces COUNT(*)
+        total_stmt = Explain(stmt.order_by(None))
+    return cursor_mode, count_mode, page, total_stmt
+
+
+def _total(value, count_mode):
+    if count_mode == "estimate":
+        return plan_rows(value)
+    return value
+
+
+def paginate(db, stmt, keys, limit: int, skip: int = 0, cursor=None, count=None) -> dict:
+    """Run a paginated select().
+
+    cursor=None is the classic skip/limit mode; any other value (an empty
+    string for the first page) switches to keyset mode. Returns the raw rows
+    (with the extra sort key columns at the end), the total according to
+    `count` (exact | estimate | none) and the next cursor.
+    """
+    cursor_mode, count_mode, page, total_stmt = _prepare(stmt, keys, limit, skip, cursor, count)
+    total = _total(db.execute(total_stmt).scalar(), count_mode) if total_stmt is not None else None
+    rows, next_cursor = finish_page(db.execute(page).all(), keys, limit, cursor_mode)
+    return {"rows": rows, "total": total, "next_cursor": next_cursor}
+
+
+async def paginate_async(db, stmt, keys, limit: int, skip: int = 0, cursor=None, count=None) -> dict:
+    """paginate() for an AsyncSession."""
+    cursor_mode, count_mode, page, total_stmt = _prepare(stmt, keys, limit, skip, cursor, count)
+    total = None
+    if total_stmt is not None:
+        total = _total((await db.execute(total_stmt)).scalar(), count_mode)
+    rows, next_cursor = finish_page((await db.execute(page)).all(), keys, limit, cursor_mode)
+    return {"rows": rows, "total": total, "next_cursor": next_cursor}
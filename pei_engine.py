@@ -0,0 +1,171 @@
+"""
+Set-based recomputation of patient_pei from base_guias and pei_temp.
+
+For each (carteirinha_id, codigo_terapia) the latest guia (data_autorizacao,
+then id) decides the row:
+- an override in pei_temp for that guia: its pei_semanal, Validado
+- otherwise qtde_solicitada / 16, Validado when that is a whole number
+- no qtde_solicitada: 0.0, Pendente
+validade is data_autorizacao + 180 days.
+
+Whatever the scope, this is a single INSERT ... SELECT DISTINCT ON ...
+ON CONFLICT statement; rows whose values did not change are left untouched
+(updated_at included). Scoped to pairs, the same statement also deletes the
+rows of pairs that no longer have any guia.
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import Float, Integer, and_, any_, bindparam, case, cast, delete, func, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.orm import Session, aliased
+
+from models import BaseGuia, PatientPei, PeiTemp
+
+PEI_WEEKS = 16
+VALIDADE_DAYS = 180
+
+
+def _pair_filter(model, pairs):
+    """(carteirinha_id, codigo_terapia) in pairs, for base_guias or patient_pei."""
+    # IN never matches a NULL codigo_terapia: those pairs go by carteirinha alone
+    pairs = list(pairs)
+    without_code = [carteirinha_id for carteirinha_id, code in pairs if code is None]
+    return or_(
+        tuple_(model.carteirinha_id, model.codigo_terapia).in_([p for p in pairs if p[1] is not None]),
+        and_(model.codigo_terapia.is_(None), model.carteirinha_id.in_(without_code))
+    )
+
+
+def _scope_filter(carteirinha_ids=None, pairs=None, changed_since=None):
+    """Where clauses on base_guias selecting the pairs to recompute (all pairs when empty)."""
+    clauses = []
+    if carteirinha_ids is not None:
+        clauses.append(BaseGuia.carteirinha_id == any_(bindparam("carteirinha_ids", list(carteirinha_ids), type_=ARRAY(Integer))))
+    if pairs is not None:
+        clauses.append(_pair_filter(BaseGuia, pairs))
+    if changed_since is not None:
+        # A pair is stale when any of its guias, or an override on one of them, changed.
+        # Correlated EXISTS rather than tuple IN, which never matches a NULL codigo_terapia
+        changed_guia = aliased(BaseGuia)
+        clauses.append(
+            select(changed_guia.id)
+            .outerjoin(PeiTemp, PeiTemp.base_guia_id == changed_guia.id)
+            .where(
+                changed_guia.carteirinha_id == BaseGuia.carteirinha_id,
+                changed_guia.codigo_terapia.is_not_distinct_from(BaseGuia.codigo_terapia),
+                or_(changed_guia.updated_at >= changed_since, PeiTemp.updated_at >= changed_since)
+            )
+            .exists()
+        )
+    return clauses
+
+
+def latest_guias(carteirinha_ids=None, pairs=None, changed_since=None):
+    """The latest guia of every (carteirinha_id, codigo_terapia) in scope."""
+    return (
+        select(
+            BaseGuia.id,
+            BaseGuia.carteirinha_id,
+            BaseGuia.codigo_terapia,
+            BaseGuia.data_autorizacao,
+            BaseGuia.qtde_solicitada
+        )
+        .where(*_scope_filter(carteirinha_ids, pairs, changed_since))
+        .distinct(BaseGuia.carteirinha_id, BaseGuia.codigo_terapia)
+        .order_by(
+            BaseGuia.carteirinha_id,
+            BaseGuia.codigo_terapia,
+            BaseGuia.data_autorizacao.desc(),
+            BaseGuia.id.desc()
+        )
+    )
+
+
+def recompute_statement(carteirinha_ids=None, pairs=None, changed_since=None):
+    latest = latest_guias(carteirinha_ids, pairs, changed_since).subquery("latest")
+    qtde = latest.c.qtde_solicitada
+    has_override = PeiTemp.id.isnot(None)
+
+    source = (
+        select(
+            latest.c.carteirinha_id,
+            latest.c.codigo_terapia,
+            latest.c.id,
+            case(
+                (has_override, PeiTemp.pei_semanal),
+                (qtde != 0, cast(qtde, Float) / PEI_WEEKS),
+                else_=0.0
+            ),
+            latest.c.data_autorizacao + VALIDADE_DAYS,
+            case(
+                (has_override, "Validado"),
+                (and_(qtde != 0, qtde % PEI_WEEKS == 0), "Validado"),
+                else_="Pendente"
+            )
+        )
+        .select_from(latest)
+        .outerjoin(PeiTemp, PeiTemp.base_guia_id == latest.c.id)
+    )
+
+    stmt = pg_insert(PatientPei).from_select(
+        [
+            PatientPei.carteirinha_id,
+            PatientPei.codigo_terapia,
+            PatientPei.base_guia_id,
+            PatientPei.pei_semanal,
+            PatientPei.validade,
+            PatientPei.status
+        ],
+        source
+    )
+    computed = [PatientPei.base_guia_id, PatientPei.pei_semanal, PatientPei.validade, PatientPei.status]
+    return stmt.on_conflict_do_update(
+        index_elements=[PatientPei.carteirinha_id, PatientPei.codigo_terapia],
+        set_={
+            **{column.key: stmt.excluded[column.key] for column in computed},
+            "updated_at": func.now()
+        },
+        where=tuple_(*computed).is_distinct_from(tuple_(*[stmt.excluded[column.key] for column in computed]))
+    ).returning(PatientPei.id)
+
+
+def orphans_statement(pairs):
+    """Deletes the patient_pei rows of the given pairs that no guia belongs to any more
+    (the guias moved to another codigo_terapia): the upsert alone would keep them."""
+    return (
+        delete(PatientPei)
+        .where(
+            _pair_filter(PatientPei, pairs),
+            ~select(BaseGuia.id)
+            .where(
+                BaseGuia.carteirinha_id == PatientPei.carteirinha_id,
+                BaseGuia.codigo_terapia.is_not_distinct_from(PatientPei.codigo_terapia)
+            )
+            .exists()
+        )
+        .returning(PatientPei.id)
+    )
+
+
+def recompute_pei(
+    db: Session,
+    carteirinha_ids: Optional[Iterable[int]] = None,
+    pairs: Optional[Iterable[Tuple[int, str]]] = None,
+    changed_since: Optional[datetime] = None
+) -> int:
+    """Recompute patient_pei for every pair, or only the given carteirinhas / pairs /
+    pairs changed since a timestamp (filters combine). Returns how many rows were
+    inserted, changed or (pairs only: left without guias) deleted. Does not commit;
+    callers also invalidate the PEI dashboard cache."""
+    if pairs is not None:
+        pairs = list(pairs)
+        if not pairs:
+            return 0
+    upserted = recompute_statement(carteirinha_ids, pairs, changed_since).cte("upserted")
+    changed = select(func.count()).select_from(upserted).scalar_subquery()
+    if pairs is not None:
+        # Same statement; the pairs it deletes are the ones the upsert has no row for
+        deleted = orphans_statement(pairs).cte("deleted")
+        changed = changed + select(func.count()).select_from(deleted).scalar_subquery()
+    return db.execute(select(changed)).scalar()
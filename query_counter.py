@@ -0,0 +1,48 @@
+"""
+Counting the SQL statements a block of code runs, to catch N+1 regressions.
+
+    with assert_max_queries(1):
+        client.get("/api/logs/?limit=100")
+
+scripts/check_query_counts.py applies this to every list endpoint.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from database import app_engines
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Collect every statement sent to the database by the app's engines."""
+    counter = QueryCounter()
+    for bind in app_engines():
+        event.listen(bind, "before_cursor_execute", counter.record)
+    try:
+        yield counter
+    finally:
+        for bind in app_engines():
+            event.remove(bind, "before_cursor_execute", counter.record)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fail with the statements that ran when the block runs more than `limit` of them."""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n\n".join(counter.statements)
+        raise AssertionError(f"{counter.count} SQL statements, expected at most {limit}:\n\n{statements}")
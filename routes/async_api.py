@@ -0,0 +1,123 @@
+"""
+Async versions of the hot read endpoints, served when DB_ASYNC is enabled.
+
+Same paths, parameters and responses as the sync routes (statements and row
+shaping are shared with them); main.py registers this router first and drops
+the sync routes it replaces. A request waiting on Postgres here holds no
+threadpool thread.
+"""
+import time
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from pagination import paginate_async, CURSOR_DESCRIPTION, COUNT_DESCRIPTION
+from routes import dashboard, guias, jobs, logs, pei
+from schemas import GuiaOut, JobOut, Page, items
+
+router = APIRouter()
+
+
+@router.get("/jobs/", tags=["Jobs"], response_model=Page[JobOut])
+async def list_jobs(
+    status: Optional[str] = None,
+    created_at_start: Optional[date] = None,
+    created_at_end: Optional[date] = None,
+    limit: int = 25,
+    skip: int = 0,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = jobs.jobs_statement(status, created_at_start, created_at_end)
+    page = await paginate_async(db, stmt, jobs.JOB_SORT_KEY, limit, skip, cursor, count)
+    return {"data": items(JobOut, page["rows"]), "total": page["total"], "skip": skip, "limit": limit, "next_cursor": page["next_cursor"]}
+
+
+@router.get("/guias/", tags=["Guias"], response_model=Page[GuiaOut])
+async def list_guias(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    created_at_start: Optional[date] = None,
+    created_at_end: Optional[date] = None,
+    carteirinha_id: Optional[int] = None,
+    limit: int = 25,
+    skip: int = 0,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = guias.guias_statement(created_at_start, created_at_end, carteirinha_id)
+    page = await paginate_async(db, stmt, guias.GUIA_SORT_KEY, limit, skip, cursor, count)
+    return {"data": items(GuiaOut, page["rows"]), "total": page["total"], "skip": skip, "limit": limit, "next_cursor": page["next_cursor"]}
+
+
+@router.get("/pei/", tags=["PEI"])
+async def list_pei(
+    page: int = 1,
+    pageSize: int = 50,
+    search: Optional[str] = None,
+    status: Optional[str] = None,
+    validade_start: Optional[date] = None,
+    validade_end: Optional[date] = None,
+    vencimento_filter: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = pei.pei_statement(search, status, validade_start, validade_end, vencimento_filter)
+    skip = (page - 1) * pageSize
+    result = await paginate_async(db, stmt, pei.PEI_SORT_KEY, pageSize, skip, cursor, count)
+    return {
+        "data": [pei.pei_item(row) for row in result["rows"]],
+        "total": result["total"],
+        "page": page,
+        "pageSize": pageSize,
+        "next_cursor": result["next_cursor"]
+    }
+
+
+@router.get("/pei/dashboard", tags=["PEI"])
+async def get_pei_dashboard_stats(response: Response, db: AsyncSession = Depends(get_async_db)):
+    started = time.perf_counter()
+    today = date.today()
+    loaded = []
+
+    async def load():
+        loaded.append(True)
+        return dict((await db.execute(pei.dashboard_statement(today))).mappings().one())
+
+    stats = await pei.dashboard_cache.get_or_load_async(today, load)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response.headers["Server-Timing"] = f'pei-stats;dur={elapsed_ms:.1f};desc="{"miss" if loaded else "hit"}"'
+    return stats
+
+
+@router.get("/dashboard/stats", tags=["Dashboard"])
+async def get_dashboard_stats(db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        return dashboard.build_stats((await db.execute(dashboard.stats_statement())).one())
+
+    return await dashboard.stats_cache.get_or_load_async("stats", load)
+
+
+@router.get("/api/logs/", tags=["Logs"])
+async def list_logs(
+    limit: int = 100,
+    level: Optional[str] = None,
+    job_id: Optional[int] = None,
+    since: Optional[datetime] = Query(None, description=logs.SINCE_DESCRIPTION),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = logs.logs_statement(level, job_id, since)
+    page = await paginate_async(db, stmt, logs.LOG_SORT_KEY, limit, cursor=cursor, count="none")
+    result = [logs.log_item(row) for row in page["rows"]]
+
+    if cursor is None:
+        return result
+    return {"data": result, "limit": limit, "next_cursor": page["next_cursor"]}
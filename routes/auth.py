@@ -1,8 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from datetime import datetime
 from database import get_db
-from models import User
+from security import check_user, get_user_by_key
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -12,30 +11,14 @@ class LoginRequest(BaseModel):
 
 @router.post("/login")
 def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.api_key == request.access_key).first()
+    # Cached lookup: reconnecting clients don't query users every time
+    user = get_user_by_key(db, request.access_key)
     
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Chave de acesso inválida."
-        )
-    
-    # Check if active
-    if user.status != "Ativo":
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Usuário inativo."
-        )
-
-    # Check validity
-    if user.validade and user.validade < datetime.now().date():
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Chave está vencida. Contratar nova."
-        )
+    # Invalid key, inactive user or expired validade
+    check_user(user)
 
     return {
-        "token": user.api_key, # Simple token for now, or could use JWT
-        "username": user.username,
-        "validade": user.validade
+        "token": request.access_key, # Simple token for now, or could use JWT
+        "username": user["username"],
+        "validade": user["validade"]
     }
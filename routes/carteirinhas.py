@@ -1,146 +1,98 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Body
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Body, Query
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from database import get_db
 from models import Carteirinha, Job, BaseGuia
+from ingestion import IngestionError, carteirinha_format_error, parse_carteirinhas_upload
+from pagination import paginate, CURSOR_DESCRIPTION, COUNT_DESCRIPTION
+from search import carteirinha_search
+from schemas import CarteirinhaOut, Page, columns, items
 from typing import List, Optional
-import io
-from openpyxl import load_workbook
+
+# Rows per INSERT statement (5 bind params each, well under the 65535 limit)
+UPLOAD_BATCH_SIZE = 1000
 
 router = APIRouter(
     prefix="/carteirinhas",
     tags=["Carteirinhas"]
 )
 
+# paciente is nullable and NULLs can't be compared in a keyset condition: patients
+# without a name sort last, as with ORDER BY paciente. Indexed in migration 0013
+CARTEIRINHA_SORT_KEY = [
+    (Carteirinha.paciente.is_(None), False),
+    (func.coalesce(Carteirinha.paciente, ''), False),
+    (Carteirinha.id, False)
+]
+
 def validate_carteirinha_format(code: str):
-    # Format: 0064.8000.400948.00-5
-    # Length: 21
-    # Check simple length first
-    if len(code) != 21:
-        raise HTTPException(status_code=400, detail=f"Carteirinha inválida: {code}. Deve conter exatamente 21 caracteres.")
-    
-    # Check punctuation positions
-    # Indices: 4, 9, 16 are '.', 19 is '-'
-    if code[4] != '.' or code[9] != '.' or code[16] != '.' or code[19] != '-':
-        raise HTTPException(status_code=400, detail=f"Carteirinha inválida: {code}. Formato incorreto de pontos e traços. Esperado: 0000.0000.000000.00-0")
+    # Format: 0064.8000.400948.00-5 (21 characters)
+    error = carteirinha_format_error(code)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+def bulk_insert_carteirinhas(db: Session, items: List[dict], batch_size: int = UPLOAD_BATCH_SIZE):
+    # Dedupe in memory (first occurrence wins), then INSERT ... ON CONFLICT DO NOTHING
+    # as an executemany, which SQLAlchemy sends as multi-row VALUES pages of
+    # batch_size rows; RETURNING tells which rows were actually inserted.
+    # Does not commit, so it can be part of a larger transaction.
+    unique_items = {}
+    for item in items:
+        unique_items.setdefault(item['carteirinha'], item)
+    if not unique_items:
+        return 0, len(items)
+
+    rows = [
+        {
+            "carteirinha": item['carteirinha'],
+            "paciente": item.get('paciente'),
+            "id_paciente": item.get('id_paciente'),
+            "id_pagamento": item.get('id_pagamento'),
+            "status": 'ativo'
+        }
+        for item in unique_items.values()
+    ]
+    # The Core table, not the ORM entity: ORM bulk inserts split the rows into
+    # separate statements by which of them have None values
+    stmt = (
+        pg_insert(Carteirinha.__table__)
+        .on_conflict_do_nothing(index_elements=[Carteirinha.carteirinha])
+        .returning(Carteirinha.id)
+    )
+    result = db.execute(
+        stmt, rows,
+        execution_options={"insertmanyvalues_page_size": batch_size}
+    )
+    count_added = len(result.all())
+
+    return count_added, len(items) - count_added
 
 @router.post("/upload")
-async def upload_carteirinhas(
+def upload_carteirinhas(
     file: UploadFile = File(...),
     overwrite: bool = Form(False),
     db: Session = Depends(get_db)
 ):
     try:
-        contents = await file.read()
-        
-        # Determine file type
-        if file.filename.endswith('.csv'):
-            # ... csv reading logic ...
-            try:
-                df = pd.read_csv(io.BytesIO(contents), encoding='utf-8', sep=';') 
-                if len(df.columns) <= 1:
-                     io.BytesIO(contents).seek(0)
-                     df = pd.read_csv(io.BytesIO(contents), encoding='utf-8', sep=',')
-            except UnicodeDecodeError:
-                io.BytesIO(contents).seek(0)
-                df = pd.read_csv(io.BytesIO(contents), encoding='latin1', sep=';')
-        else:
-             # Explicitly use openpyxl engine for .xlsx
-             df = pd.read_excel(io.BytesIO(contents), engine='openpyxl')
-        
-        # Normalize columns (uppercase/lowercase issues handling)
-        # Create a dict of normalized -> original
-        df.columns = df.columns.astype(str).str.strip()
-        
-        column_mapping = {
-            'carteiras': 'Carteirinha',
-            'Carteiras': 'Carteirinha',
-            'carteirinha': 'Carteirinha',
-            'Carteirinha': 'Carteirinha',
-            'PACIENTE': 'Paciente',
-            'paciente': 'Paciente',
-            'Paciente': 'Paciente',
-            'ID': 'IdPaciente',
-            'id': 'IdPaciente',
-            'IdPaciente': 'IdPaciente',
-            'id_paciente': 'IdPaciente',
-            'IdPagamento': 'IdPagamento',
-            'id_pagamento': 'IdPagamento',
-            'IDPAGAMENTO': 'IdPagamento'
-        }
-        
-        df.rename(columns=column_mapping, inplace=True)
-        
-        if 'Carteirinha' not in df.columns:
-             raise HTTPException(status_code=400, detail=f"Excel/CSV must contain 'Carteirinha' or 'carteiras' column. Found: {list(df.columns)}")
+        # Parse straight from the spooled upload, without reading it all into memory
+        try:
+            parsed = parse_carteirinhas_upload(file.file, file.filename)
+        except IngestionError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        carteirinhas_data = []
-        errors = []
-        
-        for index, row in df.iterrows():
-            cart = str(row['Carteirinha']).strip()
-            paciente = str(row.get('Paciente', '')).strip()
-            
-            # Convert IDs to integers
-            id_paciente = None
-            id_pagamento = None
-            
-            if 'IdPaciente' in row:
-                try:
-                    val = str(row['IdPaciente']).strip()
-                    if val and val.lower() != 'nan':
-                        id_paciente = int(float(val))  # float first to handle "123.0"
-                except (ValueError, TypeError):
-                    pass
-            
-            if 'IdPagamento' in row:
-                try:
-                    val = str(row['IdPagamento']).strip()
-                    if val and val.lower() != 'nan':
-                        id_pagamento = int(float(val))
-                except (ValueError, TypeError):
-                    pass
-            
-            if cart and cart.lower() != 'nan':
-                try:
-                    validate_carteirinha_format(cart)
-                    carteirinhas_data.append({
-                        "carteirinha": cart,
-                        "paciente": paciente,
-                        "id_paciente": id_paciente,
-                        "id_pagamento": id_pagamento
-                    })
-                except HTTPException as e:
-                    errors.append(f"Linha {index+2}: {e.detail}")
+        carteirinhas_data = parsed.items
+        errors = [f"Linha {line}: {message}" for line, message in parsed.errors]
 
         if errors:
-            raise HTTPException(status_code=400, detail="Erros de validação encontrados:\n" + "\n".join(errors[:10]) + ("..." if len(errors) > 10 else ""))
+            raise HTTPException(status_code=400, detail=f"Erros de validação encontrados ({len(errors)}):\n" + "\n".join(errors[:10]) + ("..." if len(errors) > 10 else ""))
 
+        # Overwrite is a single transactional swap: the delete and the re-insert
+        # are committed together, so readers never see an empty table
         if overwrite:
-            db.query(Carteirinha).delete()
-            db.commit()
-
+            db.execute(delete(Carteirinha))
 
-        count_added = 0
-        count_skipped = 0
-        
-        for item in carteirinhas_data:
-            existing = db.query(Carteirinha).filter(Carteirinha.carteirinha == item['carteirinha']).first()
-            if existing:
-                if overwrite:
-                    # Should not match if we deleted, unless dups in file
-                    count_skipped += 1
-                else:
-                    count_skipped += 1
-            else:
-                 new_cart = Carteirinha(
-                     carteirinha=item['carteirinha'],
-                     paciente=item['paciente'],
-                     id_paciente=item.get('id_paciente'),
-                     id_pagamento=item.get('id_pagamento'),
-                     status='ativo'
-                 )
-                 db.add(new_cart)
-                 count_added += 1
+        count_added, count_skipped = bulk_insert_carteirinhas(db, carteirinhas_data)
         
         db.commit()
         
@@ -158,31 +110,35 @@ async def upload_carteirinhas(
         traceback.print_exc() # Print stack trace to console for debugging
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
-@router.get("/")
-def list_carteirinhas(skip: int = 0, limit: int = 100, search: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(Carteirinha)
+@router.get("/", response_model=Page[CarteirinhaOut])
+def list_carteirinhas(
+    skip: int = 0,
+    limit: int = 100,
+    search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    stmt = select(*columns(CarteirinhaOut, Carteirinha))
+    sort_key = CARTEIRINHA_SORT_KEY
     
-    if search:
-        search_filter = f"%{search}%"
-        # Filter by patient name OR carteirinha number OR IDs
-        query = query.filter(
-            (Carteirinha.paciente.ilike(search_filter)) | 
-            (Carteirinha.carteirinha.ilike(search_filter)) |
-            (Carteirinha.id_paciente.ilike(search_filter)) |
-            (Carteirinha.id_pagamento.ilike(search_filter))
-        )
+    if search and search.strip():
+        # Patient name, carteirinha number or IDs (see search.py for the index paths)
+        where, rank = carteirinha_search(search)
+        stmt = stmt.where(where)
+        if rank is not None:
+            # Best matches first, then alphabetically
+            sort_key = [(rank, True)] + CARTEIRINHA_SORT_KEY
     
     # Sort alphabetically by patient name
-    query = query.order_by(Carteirinha.paciente.asc())
-    
-    total = query.count()
-    carteirinhas = query.offset(skip).limit(limit).all()
-    
+    page = paginate(db, stmt, sort_key, limit, skip, cursor, count)
+
     return {
-        "data": carteirinhas,
-        "total": total,
+        "data": items(CarteirinhaOut, page["rows"]),
+        "total": page["total"],
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": page["next_cursor"]
     }
 
 @router.post("/")
@@ -1,34 +1,49 @@
+import os
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from database import get_db
 from models import Job, Carteirinha, BaseGuia
-from sqlalchemy import func
+from sqlalchemy import func, select
+from cache import TTLCache
 
 router = APIRouter(
     prefix="/dashboard",
     tags=["Dashboard"]
 )
 
-@router.get("/stats")
-def get_dashboard_stats(db: Session = Depends(get_db)):
-    total_carteirinhas = db.query(Carteirinha).count()
-    total_guias = db.query(BaseGuia).count()
-    total_jobs = db.query(Job).count()
-    
-    # Job Status Counts
-    jobs_success = db.query(Job).filter(Job.status == 'success').count()
-    jobs_error = db.query(Job).filter(Job.status == 'error').count()
-    jobs_pending = db.query(Job).filter(Job.status.in_(['pending', 'processing'])).count()
-    
+# Seconds a computed stats payload is reused across requests/tabs
+STATS_CACHE_TTL = float(os.getenv("DASHBOARD_STATS_TTL", "10"))
+
+stats_cache = TTLCache(ttl=STATS_CACHE_TTL)
+
+def stats_statement():
+    # One round trip: table totals as scalar subqueries + conditional counts over jobs
+    return select(
+        select(func.count()).select_from(Carteirinha).scalar_subquery().label("total_carteirinhas"),
+        select(func.count()).select_from(BaseGuia).scalar_subquery().label("total_guias"),
+        func.count().label("total_jobs"),
+        func.count().filter(Job.status == 'success').label("jobs_success"),
+        func.count().filter(Job.status == 'error').label("jobs_error"),
+        func.count().filter(Job.status.in_(['pending', 'processing'])).label("jobs_pending"),
+    ).select_from(Job)
+
+def build_stats(row):
     return {
         "overview": {
-            "total_carteirinhas": total_carteirinhas,
-            "total_guias": total_guias,
-            "total_jobs": total_jobs
+            "total_carteirinhas": row.total_carteirinhas,
+            "total_guias": row.total_guias,
+            "total_jobs": row.total_jobs
         },
         "jobs_status": {
-            "success": jobs_success,
-            "error": jobs_error,
-            "pending": jobs_pending
+            "success": row.jobs_success,
+            "error": row.jobs_error,
+            "pending": row.jobs_pending
         }
     }
+
+@router.get("/stats")
+def get_dashboard_stats(db: Session = Depends(get_db)):
+    return stats_cache.get_or_load(
+        "stats",
+        lambda: build_stats(db.execute(stats_statement()).one())
+    )
@@ -1,19 +1,81 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import func, literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from database import get_db
 from models import BaseGuia, Carteirinha
-from typing import Optional
+from exports import iter_xlsx, stream_rows, XLSX_MEDIA_TYPE
+from pagination import paginate, CURSOR_DESCRIPTION, COUNT_DESCRIPTION
+from schemas import GuiaOut, Page, columns, items
+from pei_engine import recompute_pei
+from routes.pei import invalidate_dashboard_cache
+from typing import List, Optional
 from datetime import date, datetime, timedelta
-from openpyxl import Workbook
-import io
 
 router = APIRouter(
     prefix="/guias",
     tags=["Guias"]
 )
 
-@router.get("/")
+GUIA_SORT_KEY = [(BaseGuia.created_at, True), (BaseGuia.id, True)]
+
+# Rows per multi-row INSERT in POST /batch
+GUIA_UPSERT_PAGE_SIZE = 1000
+
+class GuiaIn(BaseModel):
+    carteirinha_id: int
+    guia: str
+    data_autorizacao: Optional[date] = None
+    senha: Optional[str] = None
+    validade: Optional[date] = None
+    codigo_terapia: Optional[str] = None
+    qtde_solicitada: Optional[int] = None
+    sessoes_autorizadas: Optional[int] = None
+
+# Columns written by the upsert, besides the (carteirinha_id, guia) key
+GUIA_DATA_COLUMNS = [
+    BaseGuia.data_autorizacao,
+    BaseGuia.senha,
+    BaseGuia.validade,
+    BaseGuia.codigo_terapia,
+    BaseGuia.qtde_solicitada,
+    BaseGuia.sessoes_autorizadas
+]
+
+def guia_upsert_statement():
+    # Core table: the ORM bulk path would split the rows by which keys are None
+    stmt = pg_insert(BaseGuia.__table__)
+    excluded = [stmt.excluded[column.key] for column in GUIA_DATA_COLUMNS]
+    return stmt.on_conflict_do_update(
+        index_elements=[BaseGuia.carteirinha_id, BaseGuia.guia],
+        set_={
+            **{column.key: stmt.excluded[column.key] for column in GUIA_DATA_COLUMNS},
+            "updated_at": func.now()
+        },
+        # Re-scraping an unchanged guia leaves the row (and updated_at) alone
+        where=tuple_(*GUIA_DATA_COLUMNS).is_distinct_from(tuple_(*excluded))
+    ).returning(
+        BaseGuia.carteirinha_id,
+        BaseGuia.codigo_terapia,
+        literal_column("xmax = 0").label("inserted")
+    )
+
+def guias_statement(created_at_start, created_at_end, carteirinha_id):
+    stmt = select(*columns(GuiaOut, BaseGuia))
+    
+    if created_at_start:
+        stmt = stmt.where(BaseGuia.updated_at >= created_at_start)
+    if created_at_end:
+        # Inclusive end date (until end of day)
+        end_dt = datetime.combine(created_at_end, datetime.min.time()) + timedelta(days=1)
+        stmt = stmt.where(BaseGuia.updated_at < end_dt)
+    if carteirinha_id:
+        stmt = stmt.where(BaseGuia.carteirinha_id == carteirinha_id)
+    return stmt
+
+@router.get("/", response_model=Page[GuiaOut])
 def list_guias(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
@@ -22,78 +84,118 @@ def list_guias(
     carteirinha_id: Optional[int] = None,
     limit: int = 25,
     skip: int = 0,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
-    query = db.query(BaseGuia)
-    
-    if created_at_start:
-        query = query.filter(BaseGuia.updated_at >= created_at_start)
-    if created_at_end:
-        # Inclusive end date (until end of day)
-        end_dt = datetime.combine(created_at_end, datetime.min.time()) + timedelta(days=1)
-        query = query.filter(BaseGuia.updated_at < end_dt)
-    if carteirinha_id:
-        query = query.filter(BaseGuia.carteirinha_id == carteirinha_id)
+    stmt = guias_statement(created_at_start, created_at_end, carteirinha_id)
 
-    total = query.count()
-    guias = query.order_by(BaseGuia.created_at.desc()).limit(limit).offset(skip).all()
-    
-    return {"data": guias, "total": total, "skip": skip, "limit": limit}
+    page = paginate(db, stmt, GUIA_SORT_KEY, limit, skip, cursor, count)
+
+    return {"data": items(GuiaOut, page["rows"]), "total": page["total"], "skip": skip, "limit": limit, "next_cursor": page["next_cursor"]}
 
 @router.get("/export")
 def export_guias(
     created_at_start: Optional[str] = Query(None, description="Start Date (YYYY-MM-DD)"),
     created_at_end: Optional[str] = Query(None, description="End Date (YYYY-MM-DD)"),
-    carteirinha_id: Optional[int] = Query(None, description="Filter by Carteirinha ID"),
-    db: Session = Depends(get_db)
+    carteirinha_id: Optional[int] = Query(None, description="Filter by Carteirinha ID")
 ):
-    query = db.query(BaseGuia).join(Carteirinha)
+    # Only the exported columns, with the carteirinha already joined (no lazy loads per row)
+    stmt = select(
+        Carteirinha.carteirinha,
+        Carteirinha.paciente,
+        BaseGuia.guia,
+        BaseGuia.data_autorizacao,
+        BaseGuia.senha,
+        BaseGuia.validade,
+        BaseGuia.codigo_terapia,
+        BaseGuia.qtde_solicitada,
+        BaseGuia.sessoes_autorizadas,
+        BaseGuia.created_at
+    ).join(Carteirinha, BaseGuia.carteirinha_id == Carteirinha.id)
     
     if created_at_start:
-        query = query.filter(BaseGuia.updated_at >= created_at_start)
+        stmt = stmt.where(BaseGuia.updated_at >= created_at_start)
     if created_at_end:
         # Add one day to include full end date
         end_dt = datetime.strptime(created_at_end, '%Y-%m-%d').date() + timedelta(days=1)
-        query = query.filter(BaseGuia.updated_at <= str(end_dt))
+        stmt = stmt.where(BaseGuia.updated_at <= str(end_dt))
     if carteirinha_id:
-        query = query.filter(BaseGuia.carteirinha_id == carteirinha_id)
-
-    results = query.all()
+        stmt = stmt.where(BaseGuia.carteirinha_id == carteirinha_id)
 
     # Helper to format date
     def fmt_date(d):
         return d.strftime("%d/%m/%Y") if d else ""
 
-    # Create Excel workbook with openpyxl
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Guias"
-    
+    def rows():
+        for row in stream_rows(stmt):
+            yield [
+                row.carteirinha,
+                row.paciente,
+                row.guia,
+                fmt_date(row.data_autorizacao),
+                row.senha,
+                fmt_date(row.validade),
+                row.codigo_terapia,
+                row.qtde_solicitada,
+                row.sessoes_autorizadas,
+                row.created_at.strftime("%d/%m/%Y %H:%M:%S") if row.created_at else ""
+            ]
+
     # Headers
-    headers = ["Carteirinha", "Paciente", "Guia", "Data_Autorização", "Senha", 
+    header = ["Carteirinha", "Paciente", "Guia", "Data_Autorização", "Senha", 
                "Validade", "Código_Terapia", "Qtde_Solicitada", "Sessões Autorizadas", "Importado_Em"]
-    ws.append(headers)
-    
-    # Data rows
-    for row in results:
-        ws.append([
-            row.carteirinha_rel.carteirinha if row.carteirinha_rel else "",
-            row.carteirinha_rel.paciente if row.carteirinha_rel else "",
-            row.guia,
-            fmt_date(row.data_autorizacao),
-            row.senha,
-            fmt_date(row.validade),
-            row.codigo_terapia,
-            row.qtde_solicitada,
-            row.sessoes_autorizadas,
-            row.created_at.strftime("%d/%m/%Y %H:%M:%S") if row.created_at else ""
-        ])
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
     
     headers = {
         'Content-Disposition': 'attachment; filename="guias_exportadas.xlsx"'
     }
-    return StreamingResponse(output, headers=headers, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return StreamingResponse(iter_xlsx(header, rows(), sheet_title="Guias"), headers=headers, media_type=XLSX_MEDIA_TYPE)
+
+@router.post("/batch")
+def upsert_guias(guias: List[GuiaIn], db: Session = Depends(get_db)):
+    # Keyed on (carteirinha_id, guia); a repeated key keeps the last one sent
+    rows = {(g.carteirinha_id, g.guia): g.model_dump() for g in guias}
+    if not rows:
+        return {"received": 0, "inserted": 0, "updated": 0, "unchanged": 0, "pei_updated": 0}
+
+    card_ids = {carteirinha_id for carteirinha_id, _ in rows}
+    known = set(db.execute(select(Carteirinha.id).where(Carteirinha.id.in_(card_ids))).scalars())
+    unknown = sorted(card_ids - known)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Carteirinhas inexistentes: {unknown}")
+
+    # Pairs the guias belong to before the upsert: a changed codigo_terapia
+    # must refresh the old pair as well as the new one
+    keys = list(rows)
+    old_codes = {
+        (r.carteirinha_id, r.guia): r.codigo_terapia
+        for r in db.execute(
+            select(BaseGuia.carteirinha_id, BaseGuia.guia, BaseGuia.codigo_terapia)
+            .where(tuple_(BaseGuia.carteirinha_id, BaseGuia.guia).in_(keys))
+        )
+    }
+
+    changed = db.execute(
+        guia_upsert_statement(),
+        list(rows.values()),
+        execution_options={"insertmanyvalues_page_size": GUIA_UPSERT_PAGE_SIZE}
+    ).all()
+
+    touched = {(r.carteirinha_id, r.codigo_terapia) for r in changed}
+    touched |= {
+        (carteirinha_id, code) for (carteirinha_id, guia), code in old_codes.items()
+        if code != rows[(carteirinha_id, guia)]["codigo_terapia"]
+    }
+    pei_updated = recompute_pei(db, pairs=touched) if touched else 0
+    db.commit()
+    if pei_updated:
+        invalidate_dashboard_cache()
+
+    inserted = sum(1 for r in changed if r.inserted)
+    return {
+        "received": len(guias),
+        "inserted": inserted,
+        "updated": len(changed) - inserted,
+        "unchanged": len(rows) - len(changed),
+        "pei_updated": pei_updated
+    }
@@ -1,75 +1,221 @@
 from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from sqlalchemy import Integer, and_, any_, bindparam, case, exists, func, insert, literal, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 from database import get_db
 from models import Job, Carteirinha
+from pagination import paginate, CURSOR_DESCRIPTION, COUNT_DESCRIPTION
+from schemas import JobOut, Page, columns, items
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import date, datetime, timedelta
 
+# Default lease a worker gets on a claimed job; expired leases are claimable again
+DEFAULT_LEASE_SECONDS = 600
+# Jobs that fail more than this many times stay in 'error' (see delete/retry rules)
+MAX_ATTEMPTS = 3
+# pg_advisory_xact_lock key of the dedupe mode of POST /, and how many locks the
+# carteirinhas are spread over (bounded, so type='all' stays within the lock table)
+JOB_DEDUPE_LOCK_KEY = 48062027
+JOB_DEDUPE_LOCK_BUCKETS = 64
+
 router = APIRouter(
     prefix="/jobs",
     tags=["Jobs"]
 )
 
+# priority is nullable and NULLs can't be compared in a keyset condition: jobs
+# without one sort first, as with ORDER BY priority DESC. Indexed in migration 0014
+JOB_SORT_KEY = [
+    (Job.priority.is_(None), True),
+    (func.coalesce(Job.priority, 0), True),
+    (Job.created_at, True),
+    (Job.id, True)
+]
+
 class CreateJobRequest(BaseModel):
     type: str # 'single', 'multiple', 'all'
     carteirinha_ids: Optional[List[int]] = None
+    # Skip carteirinhas that already have a pending/processing job
+    dedupe: bool = False
+
+class JobBatchResult(BaseModel):
+    worker: str
+    job_ids: List[int]
+
+def lock_dedupe_buckets(db: Session, carteirinha_ids: Optional[List[int]]):
+    """Serializes dedupe inserts that share carteirinhas until the transaction ends, so
+    two concurrent requests cannot both find no pending job and queue the same one.
+    The NOT EXISTS that follows runs with a new snapshot and sees the other's jobs.
+    Locks are taken in bucket order: no deadlock between overlapping requests."""
+    if carteirinha_ids is None:
+        buckets = list(range(JOB_DEDUPE_LOCK_BUCKETS))
+    else:
+        buckets = sorted({carteirinha_id % JOB_DEDUPE_LOCK_BUCKETS for carteirinha_id in carteirinha_ids})
+    db.execute(
+        text("SELECT count(pg_advisory_xact_lock(:key, bucket)) FROM (SELECT unnest(CAST(:buckets AS integer[])) AS bucket ORDER BY 1) b"),
+        {"key": JOB_DEDUPE_LOCK_KEY, "buckets": buckets}
+    )
 
 @router.post("/")
 def create_jobs(request: CreateJobRequest, db: Session = Depends(get_db)):
-    created_count = 0
+    # 'all' inserts one job per carteirinha
+    source = select(Carteirinha.id, literal('pending'), literal(0), literal(0))
     
-    if request.type == 'all':
-        all_carteirinhas = db.query(Carteirinha).all()
-        for cart in all_carteirinhas:
-            job = Job(carteirinha_id=cart.id, status="pending")
-            db.add(job)
-            created_count += 1
-            
-    elif request.type in ['single', 'multiple']:
+    if request.type in ['single', 'multiple']:
         if not request.carteirinha_ids:
              raise HTTPException(status_code=400, detail="carteirinha_ids required for single/multiple")
         
-        for cart_id in request.carteirinha_ids:
-            # Validate existence
-            cart = db.query(Carteirinha).filter(Carteirinha.id == cart_id).first()
-            if cart:
-                job = Job(carteirinha_id=cart.id, status="pending")
-                db.add(job)
-                created_count += 1
+        # Unknown IDs are simply not matched
+        source = source.where(Carteirinha.id == any_(bindparam("ids", request.carteirinha_ids, type_=ARRAY(Integer))))
                 
-    else:
+    elif request.type != 'all':
         raise HTTPException(status_code=400, detail="Invalid job type")
 
+    if request.dedupe:
+        lock_dedupe_buckets(db, request.carteirinha_ids if request.type != 'all' else None)
+        source = source.where(~exists().where(
+            Job.carteirinha_id == Carteirinha.id,
+            Job.status.in_(['pending', 'processing'])
+        ))
+
+    # Single INSERT ... SELECT, counted through RETURNING
+    inserted = (
+        insert(Job)
+        .from_select([Job.carteirinha_id, Job.status, Job.attempts, Job.priority], source)
+        .returning(Job.id)
+        .cte("inserted")
+    )
+    created_count = db.execute(select(func.count()).select_from(inserted)).scalar()
+
     db.commit()
     return {"message": f"Created {created_count} jobs", "count": created_count}
 
-@router.get("/")
-def list_jobs(
-    status: Optional[str] = None,
-    created_at_start: Optional[date] = None,
-    created_at_end: Optional[date] = None,
-    limit: int = 25, 
-    skip: int = 0,
+@router.post("/claim")
+def claim_jobs(
+    worker: str = Query(..., description="Worker/server identifier"),
+    n: int = Query(1, ge=1, le=500),
+    lease_seconds: int = Query(DEFAULT_LEASE_SECONDS, ge=1),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Job)
+    # Pending jobs, plus processing jobs whose lease expired (worker died mid-job)
+    claimable = (
+        select(Job.id)
+        .where(
+            (Job.status == 'pending') |
+            ((Job.status == 'processing') & (Job.timeout < func.now()))
+        )
+        .order_by(Job.priority.desc(), Job.created_at)
+        .limit(n)
+        .with_for_update(skip_locked=True)
+    )
+    # An expired lease counts as a failed attempt (SET sees the row before the update):
+    # a job that keeps killing its worker ends in 'error' like one reported through /fail
+    expired = Job.status == 'processing'
+    attempts = func.coalesce(Job.attempts, 0) + case((expired, 1), else_=0)
+    given_up = and_(expired, attempts > MAX_ATTEMPTS)
+    # One statement: concurrent workers skip each other's locked rows instead of
+    # waiting on them or claiming the same job twice
+    claimed = (
+        update(Job)
+        .where(Job.id.in_(claimable.scalar_subquery()))
+        .values(
+            attempts=attempts,
+            status=case((given_up, 'error'), else_='processing'),
+            locked_by=case((given_up, None), else_=worker),
+            timeout=case((given_up, None), else_=func.now() + timedelta(seconds=lease_seconds)),
+            updated_at=func.now()
+        )
+        .returning(Job.id, Job.carteirinha_id, Job.attempts, Job.priority, Job.timeout, Job.created_at, Job.status)
+        .cte("claimed")
+    )
+    stmt = (
+        select(
+            claimed.c.id,
+            claimed.c.carteirinha_id,
+            claimed.c.attempts,
+            claimed.c.priority,
+            claimed.c.timeout,
+            claimed.c.created_at,
+            Carteirinha.carteirinha,
+            Carteirinha.paciente
+        )
+        .join(Carteirinha, Carteirinha.id == claimed.c.carteirinha_id, isouter=True)
+        .where(claimed.c.status == 'processing')
+        .order_by(claimed.c.priority.desc(), claimed.c.created_at)
+    )
+    jobs = [dict(row) for row in db.execute(stmt).mappings()]
+    db.commit()
+
+    return {"data": jobs, "count": len(jobs), "worker": worker}
+
+@router.post("/complete")
+def complete_jobs(request: JobBatchResult, db: Session = Depends(get_db)):
+    # Only jobs still leased by this worker; a job whose lease expired and was
+    # claimed by someone else is reported back as not updated
+    stmt = (
+        update(Job)
+        .where(Job.id.in_(request.job_ids), Job.locked_by == request.worker, Job.status == 'processing')
+        .values(status='success', locked_by=None, timeout=None, updated_at=func.now())
+        .returning(Job.id)
+    )
+    updated = db.execute(stmt).scalars().all()
+    db.commit()
+
+    return {"updated": updated, "not_updated": sorted(set(request.job_ids) - set(updated))}
+
+@router.post("/fail")
+def fail_jobs(request: JobBatchResult, db: Session = Depends(get_db)):
+    # Failed jobs go back to the queue until they exceed MAX_ATTEMPTS
+    attempts = func.coalesce(Job.attempts, 0) + 1
+    stmt = (
+        update(Job)
+        .where(Job.id.in_(request.job_ids), Job.locked_by == request.worker, Job.status == 'processing')
+        .values(
+            attempts=attempts,
+            status=case((attempts > MAX_ATTEMPTS, 'error'), else_='pending'),
+            locked_by=None,
+            timeout=None,
+            updated_at=func.now()
+        )
+        .returning(Job.id, Job.status, Job.attempts)
+    )
+    updated = [dict(row) for row in db.execute(stmt).mappings()]
+    db.commit()
+
+    updated_ids = {row["id"] for row in updated}
+    return {"updated": updated, "not_updated": sorted(set(request.job_ids) - updated_ids)}
+
+def jobs_statement(status, created_at_start, created_at_end):
+    stmt = select(*columns(JobOut, Job))
     
     if status:
-        query = query.filter(Job.status == status)
+        stmt = stmt.where(Job.status == status)
         
     if created_at_start:
-        query = query.filter(Job.created_at >= created_at_start)
+        stmt = stmt.where(Job.created_at >= created_at_start)
     if created_at_end:
         end_dt = datetime.combine(created_at_end, datetime.min.time()) + timedelta(days=1)
-        query = query.filter(Job.created_at < end_dt)
-    
-    # Order by priority desc, created_at asc
-    total = query.count()
-    jobs = query.order_by(Job.priority.desc(), Job.created_at.desc()).limit(limit).offset(skip).all()
-    # Note: Changed order to desc created_at to show newest first
+        stmt = stmt.where(Job.created_at < end_dt)
+    return stmt
+
+@router.get("/", response_model=Page[JobOut])
+def list_jobs(
+    status: Optional[str] = None,
+    created_at_start: Optional[date] = None,
+    created_at_end: Optional[date] = None,
+    limit: int = 25, 
+    skip: int = 0,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    stmt = jobs_statement(status, created_at_start, created_at_end)
     
-    return {"data": jobs, "total": total, "skip": skip, "limit": limit}
+    # Order by priority desc, created_at desc (newest first), id as tie-breaker
+    page = paginate(db, stmt, JOB_SORT_KEY, limit, skip, cursor, count)
+
+    return {"data": items(JobOut, page["rows"]), "total": page["total"], "skip": skip, "limit": limit, "next_cursor": page["next_cursor"]}
 
 @router.delete("/{id}")
 def delete_job(id: int, db: Session = Depends(get_db)):
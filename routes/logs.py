@@ -1,40 +1,162 @@
-from fastapi import APIRouter, Depends, HTTPException
+import os
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database import get_db
-from models import Log, Carteirinha, Job
+from models import Log, Carteirinha
+from pagination import paginate, CURSOR_DESCRIPTION
 from typing import List, Optional
 
 router = APIRouter(
     tags=["Logs"]
 )
 
+# Largest batch accepted by POST /batch (logs and body size), and rows per multi-row INSERT
+LOG_BATCH_MAX = int(os.getenv("LOG_BATCH_MAX", "10000"))
+LOG_BATCH_MAX_BYTES = int(os.getenv("LOG_BATCH_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_INSERT_PAGE_SIZE = 1000
+# Opt-in: when > 0, the list without `since` (or job_id) only covers this many days, so
+# Postgres reads the recent monthly partitions instead of all of them. 0 lists everything
+LOG_LIST_DEFAULT_DAYS = int(os.getenv("LOG_LIST_DEFAULT_DAYS", "0"))
+SINCE_DESCRIPTION = "Only logs created at or after this time" + (
+    f". Default: the last {LOG_LIST_DEFAULT_DAYS} days, unless job_id is given" if LOG_LIST_DEFAULT_DAYS > 0 else ""
+)
+
+class LogEntry(BaseModel):
+    job_id: Optional[int] = None
+    carteirinha_id: Optional[int] = None
+    level: str = "INFO"
+    message: str
+    # When the worker logged it; defaults to the time the batch was received
+    created_at: Optional[datetime] = None
+
+log_entries = TypeAdapter(List[LogEntry])
+
+async def read_log_batch(request: Request) -> bytes:
+    """The request body, refused with 413 past LOG_BATCH_MAX_BYTES before it is all buffered."""
+    too_large = HTTPException(status_code=413, detail=f"Lote maior que {LOG_BATCH_MAX_BYTES} bytes.")
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > LOG_BATCH_MAX_BYTES:
+        raise too_large
+
+    # Chunked bodies carry no Content-Length: counted as they arrive
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > LOG_BATCH_MAX_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def parse_log_batch(body: bytes, content_type: str) -> List[LogEntry]:
+    """A JSON array, or NDJSON (one object per line)."""
+    if "ndjson" not in content_type and body.lstrip()[:1] == b"[":
+        try:
+            return log_entries.validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Lote inválido: {e.errors(include_url=False)}")
+
+    entries = []
+    for line_num, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            entries.append(LogEntry.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Linha {line_num} inválida: {e.errors(include_url=False)}")
+    return entries
+
+def insert_logs(db: Session, entries: List[LogEntry]) -> int:
+    received_at = datetime.now(timezone.utc)
+    rows = [
+        {**entry.model_dump(), "created_at": entry.created_at or received_at}
+        for entry in entries
+    ]
+    # executemany on the Core table (ORM bulk inserts would split the rows by
+    # which keys are None): sent as multi-row INSERTs of LOG_INSERT_PAGE_SIZE rows
+    try:
+        db.execute(insert(Log.__table__), rows, execution_options={"insertmanyvalues_page_size": LOG_INSERT_PAGE_SIZE})
+        db.commit()
+    except IntegrityError:
+        # Still in the threadpool: the rollback round-trip does not block the event loop
+        db.rollback()
+        raise
+    return len(rows)
+
+LOG_SORT_KEY = [(Log.created_at, True), (Log.id, True)]
+
+def logs_statement(level, job_id, since=None):
+    if since is None and not job_id and LOG_LIST_DEFAULT_DAYS > 0:
+        since = datetime.now(timezone.utc) - timedelta(days=LOG_LIST_DEFAULT_DAYS)
+    # Only the returned columns, with the carteirinha joined in (no lazy load per log)
+    stmt = select(
+        Log.id,
+        Log.level,
+        Log.message,
+        Log.created_at,
+        Log.job_id,
+        Carteirinha.carteirinha,
+        Carteirinha.paciente
+    ).select_from(Log).join(Carteirinha, Carteirinha.id == Log.carteirinha_id, isouter=True)
+    
+    if level:
+        stmt = stmt.where(Log.level == level)
+    if job_id:
+        stmt = stmt.where(Log.job_id == job_id)
+    if since:
+        # Lets Postgres skip the older monthly partitions entirely
+        stmt = stmt.where(Log.created_at >= since)
+    return stmt
+
+def log_item(row):
+    return {
+        "id": row.id,
+        "level": row.level,
+        "message": row.message,
+        "created_at": row.created_at,
+        "job_id": row.job_id,
+        "carteirinha": row.carteirinha,
+        "paciente": row.paciente
+    }
+
 @router.get("/")
 def list_logs(
     limit: int = 100, 
     level: Optional[str] = None, 
     job_id: Optional[int] = None,
+    since: Optional[datetime] = Query(None, description=SINCE_DESCRIPTION),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Log).join(Job, isouter=True).join(Carteirinha, isouter=True)
-    
-    if level:
-        query = query.filter(Log.level == level)
-    if job_id:
-        query = query.filter(Log.job_id == job_id)
+    stmt = logs_statement(level, job_id, since)
         
-    logs = query.order_by(Log.created_at.desc()).limit(limit).all()
+    # Newest first; the plain list never needed a total
+    page = paginate(db, stmt, LOG_SORT_KEY, limit, cursor=cursor, count="none")
     
     # Return enriched data
-    result = []
-    for log in logs:
-        result.append({
-            "id": log.id,
-            "level": log.level,
-            "message": log.message,
-            "created_at": log.created_at,
-            "job_id": log.job_id,
-            "carteirinha": log.carteirinha_rel.carteirinha if log.carteirinha_rel else None,
-            "paciente": log.carteirinha_rel.paciente if log.carteirinha_rel else None
-        })
-        
-    return result
+    result = [log_item(row) for row in page["rows"]]
+    
+    # Without a cursor the response stays a plain list, as before
+    if cursor is None:
+        return result
+    return {"data": result, "limit": limit, "next_cursor": page["next_cursor"]}
+
+@router.post("/batch")
+async def ingest_logs(request: Request, db: Session = Depends(get_db)):
+    # Workers buffer their log lines and flush them here every few seconds
+    entries = parse_log_batch(await read_log_batch(request), request.headers.get("content-type", ""))
+    if len(entries) > LOG_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Lote com mais de {LOG_BATCH_MAX} logs.")
+    if not entries:
+        return {"inserted": 0}
+
+    try:
+        inserted = await run_in_threadpool(insert_logs, db, entries)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="job_id ou carteirinha_id inexistente no lote.")
+    return {"inserted": inserted}
@@ -1,35 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Query
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from database import get_db
 from models import PatientPei, PeiTemp, BaseGuia, Carteirinha
+from exports import iter_csv, iter_xlsx, stream_rows, CSV_MEDIA_TYPE, XLSX_MEDIA_TYPE
+from pagination import paginate, CURSOR_DESCRIPTION, COUNT_DESCRIPTION
+from search import pei_search
+from pei_engine import recompute_pei
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import date, timedelta, datetime
-from sqlalchemy import func, or_, text
-import io
-import openpyxl
+from sqlalchemy import Integer, any_, bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from cache import TTLCache
+import os
+import time
 
 router = APIRouter(
     prefix="/pei",
     tags=["PEI"]
 )
 
+# Seconds the PEI dashboard counts are reused when nothing was written in between
+DASHBOARD_CACHE_TTL = float(os.getenv("PEI_DASHBOARD_TTL", "60"))
+
+dashboard_cache = TTLCache(ttl=DASHBOARD_CACHE_TTL)
+
+# status is nullable: rows without one sort last, as with ORDER BY status, and the
+# keyset condition compares non-NULL values only. Indexed in migration 0014
+PEI_SORT_KEY = [
+    (PatientPei.status.is_(None), False),
+    (func.coalesce(PatientPei.status, ''), False),
+    (PatientPei.updated_at, True),
+    (PatientPei.id, True)
+]
+
 class PeiOverrideRequest(BaseModel):
     guia_id: int
     pei_semanal: float
 
+class PeiRecomputeRequest(BaseModel):
+    # Both optional and combinable; neither recomputes every patient
+    carteirinha_ids: Optional[List[int]] = None
+    changed_since: Optional[datetime] = None
+
 def apply_filters(query, search, status, validade_start, validade_end, vencimento_filter):
+    # Accepts both ORM queries and select() statements (both expose .filter)
     # Text Search (Patient, Carteirinha, Therapy)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                Carteirinha.paciente.ilike(search_term),
-                Carteirinha.carteirinha.ilike(search_term),
-                PatientPei.codigo_terapia.ilike(search_term)
-            )
-        )
+    if search and search.strip():
+        query = query.filter(pei_search(search))
     
     # Status Enum
     if status:
@@ -55,41 +74,68 @@ def apply_filters(query, search, status, validade_start, validade_end, venciment
             
     return query
 
-@router.get("/dashboard")
-def get_dashboard_stats(db: Session = Depends(get_db)):
-    today = date.today()
-    
-    # Base query for active patients? Or just all?
-    # Stats: Vencidos, Vence D+7, Vence D+30
-    
-    # Vencidos
-    vencidos = db.query(func.count(PatientPei.id)).filter(PatientPei.validade < today).scalar()
-    
-    # Vence D+7
+def dashboard_statement(today: date):
+    # All six buckets in a single scan of patient_pei
     d7_end = today + timedelta(days=7)
-    vence_d7 = db.query(func.count(PatientPei.id)).filter(
-        PatientPei.validade >= today, 
-        PatientPei.validade <= d7_end
-    ).scalar()
-    
-    # Vence D+30
     d30_end = today + timedelta(days=30)
-    vence_d30 = db.query(func.count(PatientPei.id)).filter(
-        PatientPei.validade >= today, 
-        PatientPei.validade <= d30_end
-    ).scalar()
-    
-    total = db.query(func.count(PatientPei.id)).scalar()
-    pendentes = db.query(func.count(PatientPei.id)).filter(PatientPei.status == 'Pendente').scalar()
-    validados = db.query(func.count(PatientPei.id)).filter(PatientPei.status == 'Validado').scalar()
+    return select(
+        func.count(PatientPei.id).label("total"),
+        func.count(PatientPei.id).filter(PatientPei.validade < today).label("vencidos"),
+        func.count(PatientPei.id).filter(PatientPei.validade >= today, PatientPei.validade <= d7_end).label("vence_d7"),
+        func.count(PatientPei.id).filter(PatientPei.validade >= today, PatientPei.validade <= d30_end).label("vence_d30"),
+        func.count(PatientPei.id).filter(PatientPei.status == 'Pendente').label("pendentes"),
+        func.count(PatientPei.id).filter(PatientPei.status == 'Validado').label("validados"),
+    )
+
+def invalidate_dashboard_cache():
+    # Call after any write to patient_pei
+    dashboard_cache.invalidate()
 
+@router.get("/dashboard")
+def get_dashboard_stats(response: Response, db: Session = Depends(get_db)):
+    started = time.perf_counter()
+    today = date.today()
+    loaded = []
+
+    def load():
+        loaded.append(True)
+        return dict(db.execute(dashboard_statement(today)).mappings().one())
+
+    # Keyed on the day: the vencimento buckets move at midnight
+    stats = dashboard_cache.get_or_load(today, load)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response.headers["Server-Timing"] = f'pei-stats;dur={elapsed_ms:.1f};desc="{"miss" if loaded else "hit"}"'
+    return stats
+
+def pei_statement(search, status, validade_start, validade_end, vencimento_filter):
+    # Only the returned columns, with the carteirinha joined in (no lazy load per row)
+    stmt = select(
+        PatientPei.id,
+        PatientPei.carteirinha_id,
+        Carteirinha.carteirinha,
+        Carteirinha.paciente,
+        PatientPei.codigo_terapia,
+        PatientPei.pei_semanal,
+        PatientPei.validade,
+        PatientPei.status,
+        PatientPei.base_guia_id,
+        PatientPei.updated_at
+    ).select_from(PatientPei).join(Carteirinha)
+    return apply_filters(stmt, search, status, validade_start, validade_end, vencimento_filter)
+
+def pei_item(row):
     return {
-        "total": total,
-        "vencidos": vencidos or 0,
-        "vence_d7": vence_d7 or 0,
-        "vence_d30": vence_d30 or 0,
-        "pendentes": pendentes or 0,
-        "validados": validados or 0
+        "id": row.id,
+        "carteirinha_id": row.carteirinha_id,
+        "carteirinha": row.carteirinha,
+        "paciente": row.paciente,
+        "codigo_terapia": row.codigo_terapia,
+        "pei_semanal": row.pei_semanal,
+        "validade": row.validade,
+        "status": row.status,
+        "base_guia_id": row.base_guia_id,
+        "updated_at": row.updated_at
     }
 
 @router.get("/")
@@ -101,42 +147,28 @@ def list_pei(
     validade_start: Optional[date] = None,
     validade_end: Optional[date] = None,
     vencimento_filter: Optional[str] = None, # vencidos, vence_d7, vence_d30
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    count: Optional[str] = Query(None, description=COUNT_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
-    query = db.query(PatientPei).join(Carteirinha)
-    query = apply_filters(query, search, status, validade_start, validade_end, vencimento_filter)
-    
-    total_items = query.count()
+    stmt = pei_statement(search, status, validade_start, validade_end, vencimento_filter)
     
     # Pagination
     skip = (page - 1) * pageSize
     # Sorting: Pendente first, then Updated At desc
     # status is text: 'Pendente', 'Validado'
-    # We can use order_by with a case statement or just simple text sort if alphabetical works (P < V).
     # 'Pendente' comes before 'Validado' alphabetically, so ASC status puts Pendente first.
     # Then updated_at DESC.
-    results = query.order_by(PatientPei.status.asc(), PatientPei.updated_at.desc()).offset(skip).limit(pageSize).all()
+    result = paginate(db, stmt, PEI_SORT_KEY, pageSize, skip, cursor, count)
     
-    data = []
-    for row in results:
-        data.append({
-            "id": row.id,
-            "carteirinha_id": row.carteirinha_id,
-            "carteirinha": row.carteirinha_rel.carteirinha if row.carteirinha_rel else "",
-            "paciente": row.carteirinha_rel.paciente if row.carteirinha_rel else "",
-            "codigo_terapia": row.codigo_terapia,
-            "pei_semanal": row.pei_semanal,
-            "validade": row.validade,
-            "status": row.status,
-            "base_guia_id": row.base_guia_id,
-            "updated_at": row.updated_at
-        })
+    data = [pei_item(row) for row in result["rows"]]
 
     return {
         "data": data,
-        "total": total_items,
+        "total": result["total"],
         "page": page,
-        "pageSize": pageSize
+        "pageSize": pageSize,
+        "next_cursor": result["next_cursor"]
     }
 
 @router.get("/export")
@@ -146,60 +178,42 @@ def export_pei(
     validade_start: Optional[date] = None,
     validade_end: Optional[date] = None,
     vencimento_filter: Optional[str] = None,
-    db: Session = Depends(get_db)
+    format: str = Query("xlsx", description="xlsx ou csv")
 ):
-    query = db.query(PatientPei).join(Carteirinha)
-    query = apply_filters(query, search, status, validade_start, validade_end, vencimento_filter)
-    
-    try:
-        results = query.all()
-        
-        # Generate Excel
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "PEI Export"
-        
-        # Header
-        ws.append([
-            "ID", "Paciente", "Carteirinha", "Código Terapia", 
-            "PEI Semanal", "Validade", "Status", "Atualizado Em"
-        ])
-        
-        for row in results:
-            # Handle timezone naive for Excel
-            updated_at_val = row.updated_at
-            if updated_at_val and updated_at_val.tzinfo:
-                updated_at_val = updated_at_val.replace(tzinfo=None)
+    if format not in ("xlsx", "csv"):
+        raise HTTPException(status_code=400, detail="Formato inválido. Use 'xlsx' ou 'csv'.")
 
-            ws.append([
-                row.id,
-                row.carteirinha_rel.paciente if row.carteirinha_rel else "",
-                row.carteirinha_rel.carteirinha if row.carteirinha_rel else "",
-                row.codigo_terapia,
-                row.pei_semanal,
-                row.validade,
-                row.status,
-                updated_at_val
-            ])
-            
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        filename = f"export_pei_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        headers = {
-            'Content-Disposition': f'attachment; filename="{filename}"'
-        }
-        
-        return Response(
-            content=output.getvalue(), 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-            headers=headers
-        )
-    except Exception as e:
-        print(f"Export Error: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Erro ao exportar: {str(e)}")
+    # Only the exported columns, as tuples (no ORM objects, no lazy carteirinha_rel)
+    stmt = select(
+        PatientPei.id,
+        Carteirinha.paciente,
+        Carteirinha.carteirinha,
+        PatientPei.codigo_terapia,
+        PatientPei.pei_semanal,
+        PatientPei.validade,
+        PatientPei.status,
+        PatientPei.updated_at
+    ).select_from(PatientPei).join(Carteirinha)
+    stmt = apply_filters(stmt, search, status, validade_start, validade_end, vencimento_filter)
+
+    columns = [
+        "ID", "Paciente", "Carteirinha", "Código Terapia", 
+        "PEI Semanal", "Validade", "Status", "Atualizado Em"
+    ]
+    rows = (
+        [row.id, row.paciente or "", row.carteirinha or "", row.codigo_terapia,
+         row.pei_semanal, row.validade, row.status, row.updated_at]
+        for row in stream_rows(stmt)
+    )
+
+    filename = f"export_pei_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    }
+
+    if format == "csv":
+        return StreamingResponse(iter_csv(columns, rows), media_type=CSV_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(iter_xlsx(columns, rows, sheet_title="PEI Export"), media_type=XLSX_MEDIA_TYPE, headers=headers)
 
 @router.post("/override")
 def override_pei(
@@ -223,55 +237,52 @@ def override_pei(
     update_patient_pei_backend(db, guia.carteirinha_id, guia.codigo_terapia)
     return {"status": "success"}
 
-def update_patient_pei_backend(db: Session, carteirinha_id: int, codigo_terapia: str):
-    # Same logic as Worker
-    latest_guia = db.query(BaseGuia).filter(
-        BaseGuia.carteirinha_id == carteirinha_id,
-        BaseGuia.codigo_terapia == codigo_terapia
-    ).order_by(BaseGuia.data_autorizacao.desc(), BaseGuia.id.desc()).first()
+@router.post("/override/batch")
+def override_pei_batch(items: List[PeiOverrideRequest], db: Session = Depends(get_db)):
+    # Repeated guia_id: the last value sent wins
+    overrides = {item.guia_id: item.pei_semanal for item in items}
+    if not overrides:
+        return {"updated": 0, "not_found": 0, "results": []}
 
-    if not latest_guia:
-        return
+    guias = db.execute(
+        select(BaseGuia.id, BaseGuia.carteirinha_id, BaseGuia.codigo_terapia)
+        .where(BaseGuia.id == any_(bindparam("ids", list(overrides), type_=ARRAY(Integer))))
+    ).all()
+    found = {g.id: g for g in guias}
 
-    override = db.query(PeiTemp).filter(PeiTemp.base_guia_id == latest_guia.id).first()
-    
-    status = "Pendente"
-    pei_semanal = 0.0
-    validade = None
-    
-    if latest_guia.data_autorizacao:
-        validade = latest_guia.data_autorizacao + timedelta(days=180)
-    
-    if override:
-        pei_semanal = float(override.pei_semanal)
-        status = "Validado" 
-    else:
-        if latest_guia.qtde_solicitada:
-             val = float(latest_guia.qtde_solicitada) / 16.0
-             pei_semanal = val
-             if val.is_integer():
-                 status = "Validado"
-             else:
-                 status = "Pendente"
-        else:
-            pei_semanal = 0.0
-            status = "Pendente"
+    applied = set()
+    if found:
+        stmt = pg_insert(PeiTemp).values([
+            {"base_guia_id": guia_id, "pei_semanal": overrides[guia_id]} for guia_id in found
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[PeiTemp.base_guia_id],
+            set_={"pei_semanal": stmt.excluded.pei_semanal, "updated_at": func.now()}
+        ))
+        recompute_pei(db, pairs={(g.carteirinha_id, g.codigo_terapia) for g in guias})
+        # An override only counts when its guia is the latest of the pair
+        applied = set(db.execute(
+            select(PatientPei.base_guia_id).where(PatientPei.base_guia_id.in_(list(found)))
+        ).scalars())
+    db.commit()
+    invalidate_dashboard_cache()
 
-    patient_pei = db.query(PatientPei).filter(
-        PatientPei.carteirinha_id == carteirinha_id,
-        PatientPei.codigo_terapia == codigo_terapia
-    ).first()
+    results = [
+        {"guia_id": guia_id, "status": "updated" if guia_id in found else "not_found", "applied": guia_id in applied}
+        for guia_id in overrides
+    ]
+    return {"updated": len(found), "not_found": len(overrides) - len(found), "results": results}
 
-    if not patient_pei:
-        patient_pei = PatientPei(
-            carteirinha_id=carteirinha_id,
-            codigo_terapia=codigo_terapia
-        )
-        db.add(patient_pei)
-    
-    patient_pei.base_guia_id = latest_guia.id
-    patient_pei.pei_semanal = pei_semanal
-    patient_pei.validade = validade
-    patient_pei.status = status
-    
+@router.post("/recompute")
+def recompute_pei_endpoint(req: PeiRecomputeRequest, db: Session = Depends(get_db)):
+    # e.g. after a scrape run: {"changed_since": "<run start>"}; an empty body rebuilds everything
+    updated = recompute_pei(db, carteirinha_ids=req.carteirinha_ids, changed_since=req.changed_since)
+    db.commit()
+    invalidate_dashboard_cache()
+    return {"status": "success", "updated": updated}
+
+def update_patient_pei_backend(db: Session, carteirinha_id: int, codigo_terapia: str):
+    # Same logic as Worker, for a single pair (see pei_engine)
+    recompute_pei(db, pairs=[(carteirinha_id, codigo_terapia)])
     db.commit()
+    invalidate_dashboard_cache()
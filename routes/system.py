@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from database import pool_stats
+
+router = APIRouter(
+    prefix="/system",
+    tags=["System"]
+)
+
+@router.get("/pool")
+def get_pool_stats():
+    # Connection pool usage, to size DB_POOL_SIZE / DB_MAX_OVERFLOW from real data
+    return pool_stats()
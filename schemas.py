@@ -0,0 +1,72 @@
+"""
+Response schemas of the list endpoints.
+
+The list queries select the columns behind these fields, in field order (see
+`columns`), and each row tuple is zipped with the field names (`items`): no ORM
+instances are built per row, and only the declared fields reach the payload.
+"""
+from datetime import date, datetime
+from typing import Annotated, Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel, PlainSerializer
+
+T = TypeVar("T")
+
+# isoformat() as before (pydantic would write UTC as "Z" instead of "+00:00")
+Timestamp = Annotated[datetime, PlainSerializer(datetime.isoformat, return_type=str, when_used="json")]
+
+
+class CarteirinhaOut(BaseModel):
+    id: int
+    carteirinha: str
+    paciente: Optional[str] = None
+    id_paciente: Optional[int] = None
+    id_pagamento: Optional[int] = None
+    status: Optional[str] = None
+    created_at: Optional[Timestamp] = None
+    updated_at: Optional[Timestamp] = None
+
+
+class JobOut(BaseModel):
+    id: int
+    carteirinha_id: Optional[int] = None
+    status: str
+    attempts: Optional[int] = None
+    priority: Optional[int] = None
+    locked_by: Optional[str] = None
+    timeout: Optional[Timestamp] = None
+    created_at: Optional[Timestamp] = None
+    updated_at: Optional[Timestamp] = None
+
+
+class GuiaOut(BaseModel):
+    id: int
+    carteirinha_id: Optional[int] = None
+    guia: Optional[str] = None
+    data_autorizacao: Optional[date] = None
+    senha: Optional[str] = None
+    validade: Optional[date] = None
+    codigo_terapia: Optional[str] = None
+    qtde_solicitada: Optional[int] = None
+    sessoes_autorizadas: Optional[int] = None
+    created_at: Optional[Timestamp] = None
+    updated_at: Optional[Timestamp] = None
+
+
+class Page(BaseModel, Generic[T]):
+    data: List[T]
+    total: Optional[int] = None
+    skip: int
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+def columns(schema, model):
+    """The model columns behind the schema's fields, in field order."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def items(schema, rows):
+    """Row tuples of a columns(schema) select as dicts; trailing columns (sort keys) are dropped."""
+    fields = list(schema.model_fields)
+    return [dict(zip(fields, row)) for row in rows]
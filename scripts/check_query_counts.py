@@ -0,0 +1,58 @@
+"""
+Check how many SQL statements each read endpoint runs (N+1 regressions)
+Runs the app in-process against DATABASE_URL, which should hold some data
+Exits with status 1 when an endpoint goes over its budget
+
+    DATABASE_URL=postgresql://... python scripts/check_query_counts.py
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from main import app
+from query_counter import assert_max_queries
+
+# (url, max statements): page + count for the offset lists, page only with a cursor
+QUERY_BUDGETS = [
+    ("/carteirinhas/?limit=100", 2),
+    ("/jobs/?limit=100", 2),
+    ("/jobs/?limit=100&cursor=", 1),
+    ("/guias/?limit=100", 2),
+    ("/guias/?limit=100&cursor=", 1),
+    ("/pei/?pageSize=100", 2),
+    ("/pei/?pageSize=100&cursor=", 1),
+    ("/api/logs/?limit=100", 1),
+    ("/api/logs/?limit=100&cursor=", 1),
+    ("/dashboard/stats", 1),
+    ("/pei/dashboard", 1),
+    ("/guias/export", 1),
+    ("/pei/export?format=csv", 1),
+]
+
+def check_query_counts():
+    headers = {}
+    # Needed when the app runs with AUTH_REQUIRED
+    if os.getenv("API_KEY"):
+        headers["Authorization"] = f"Bearer {os.getenv('API_KEY')}"
+
+    failures = 0
+    with TestClient(app) as client:
+        # Warm the auth cache so its lookup is not counted against the first endpoint
+        client.get("/system/pool", headers=headers)
+        for url, budget in QUERY_BUDGETS:
+            try:
+                with assert_max_queries(budget) as counter:
+                    response = client.get(url, headers=headers)
+                    response.raise_for_status()
+                print(f"✓ {url}: {counter.count} (max {budget})")
+            except AssertionError as e:
+                failures += 1
+                print(f"❌ {url}: {e}")
+
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if check_query_counts() else 0)
@@ -0,0 +1,129 @@
+"""
+Regression checks for fixed bugs, run against DATABASE_URL (migrated, may hold data)
+Each check works in its own transaction and rolls it back, leaving the data untouched
+Exits with status 1 when a check fails
+
+    DATABASE_URL=postgresql://... python scripts/check_regressions.py
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import date, timedelta
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from database import engine
+from models import BaseGuia, Carteirinha, Job, PatientPei
+from pagination import Explain, page_statement
+from pei_engine import recompute_pei
+from routes import guias, jobs, logs
+
+def new_carteirinha(db, code):
+    carteirinha = Carteirinha(carteirinha=code, paciente="Paciente Regressao")
+    db.add(carteirinha)
+    db.flush()
+    return carteirinha
+
+def check_changed_since_null_codigo_terapia(db):
+    """recompute_pei(changed_since=...) picks up a changed guia that has no codigo_terapia."""
+    carteirinha = new_carteirinha(db, "0000.0000.000000.00-1")
+    guia = BaseGuia(carteirinha_id=carteirinha.id, guia="regressao-1", data_autorizacao=date.today(), qtde_solicitada=16)
+    db.add(guia)
+    db.flush()
+    recompute_pei(db, carteirinha_ids=[carteirinha.id])
+
+    # now() is the transaction start: date the existing rows back, then change the guia after the cutoff
+    db.execute(text("UPDATE base_guias SET updated_at = now() - interval '1 day' WHERE id = :id"), {"id": guia.id})
+    changed_since = db.execute(select(func.now() - timedelta(hours=1))).scalar()
+    db.execute(text("UPDATE base_guias SET qtde_solicitada = 32, updated_at = now() WHERE id = :id"), {"id": guia.id})
+
+    recompute_pei(db, changed_since=changed_since)
+    pei_semanal = db.execute(
+        select(PatientPei.pei_semanal).where(PatientPei.carteirinha_id == carteirinha.id, PatientPei.codigo_terapia.is_(None))
+    ).scalar()
+    assert pei_semanal == 2.0, f"expected pei_semanal 2.0 after the change, got {pei_semanal}"
+
+def check_expired_lease_counts_as_attempt(db):
+    """A job whose lease keeps expiring (its worker dies mid-run) ends in 'error'."""
+    carteirinha = new_carteirinha(db, "0000.0000.000000.00-2")
+    # Top priority, so every claim picks it first
+    job = Job(carteirinha_id=carteirinha.id, status="pending", attempts=0, priority=1_000_000)
+    db.add(job)
+    db.flush()
+
+    for _ in range(jobs.MAX_ATTEMPTS + 2):
+        claimed = jobs.claim_jobs(worker="regressao", n=1, lease_seconds=60, db=db)
+        claimed_ids = [row["id"] for row in claimed["data"]]
+        db.execute(text("UPDATE jobs SET timeout = now() - interval '1 second' WHERE id = :id AND status = 'processing'"), {"id": job.id})
+    db.refresh(job)
+    assert job.status == "error", f"expected status error after {jobs.MAX_ATTEMPTS + 2} expired leases, got {job.status} ({job.attempts} attempts)"
+    assert job.id not in claimed_ids, "the job was handed out again after giving up"
+
+def check_moved_guia_leaves_no_stale_pei(db):
+    """A guia moved to another codigo_terapia takes the old pair's patient_pei row with it."""
+    carteirinha = new_carteirinha(db, "0000.0000.000000.00-3")
+    guia = {"carteirinha_id": carteirinha.id, "guia": "regressao-3", "data_autorizacao": date.today(), "qtde_solicitada": 16}
+    guias.upsert_guias([guias.GuiaIn(**guia, codigo_terapia="2250005")], db=db)
+    guias.upsert_guias([guias.GuiaIn(**guia, codigo_terapia="2250013")], db=db)
+
+    codes = db.execute(select(PatientPei.codigo_terapia).where(PatientPei.carteirinha_id == carteirinha.id)).scalars().all()
+    assert codes == ["2250013"], f"expected only the new pair in patient_pei, got {codes}"
+
+def scanned_relations(plan):
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        relations |= scanned_relations(child)
+    return relations
+
+def check_recent_logs_list_prunes_partitions(db):
+    """With LOG_LIST_DEFAULT_DAYS set, the GET /api/logs list only reads the partitions of its window."""
+    if not db.execute(text("SELECT to_regproc('ensure_logs_partition') IS NOT NULL")).scalar():
+        raise AssertionError("logs is not partitioned (migration 0008)")
+    # The window is opt-in (0 by default): check it with the configured one, or 30 days
+    days = logs.LOG_LIST_DEFAULT_DAYS or 30
+    # A partition well before the window, and the current one
+    old = db.execute(text("SELECT ensure_logs_partition((now() - make_interval(days => :days + 62))::date)"), {"days": days}).scalar()
+    current = db.execute(text("SELECT ensure_logs_partition(now()::date)")).scalar()
+
+    configured, logs.LOG_LIST_DEFAULT_DAYS = logs.LOG_LIST_DEFAULT_DAYS, days
+    try:
+        stmt = page_statement(logs.logs_statement(None, None), logs.LOG_SORT_KEY, 100)
+    finally:
+        logs.LOG_LIST_DEFAULT_DAYS = configured
+    plan = db.execute(Explain(stmt)).scalar()
+    scanned = scanned_relations(plan[0]["Plan"])
+    assert current in scanned, f"expected {current} in the plan, scanned: {sorted(scanned)}"
+    assert old not in scanned, f"{old} is older than the window but was scanned: {sorted(scanned)}"
+
+CHECKS = [
+    check_changed_since_null_codigo_terapia,
+    check_expired_lease_counts_as_attempt,
+    check_moved_guia_leaves_no_stale_pei,
+    check_recent_logs_list_prunes_partitions,
+]
+
+def check_regressions():
+    failures = 0
+    for check in CHECKS:
+        # Route handlers commit: inside the outer transaction those commits only release savepoints
+        connection = engine.connect()
+        transaction = connection.begin()
+        db = Session(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            check(db)
+            print(f"✓ {check.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {check.__name__}: {e}")
+        finally:
+            db.close()
+            transaction.rollback()
+            connection.close()
+
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if check_regressions() else 0)
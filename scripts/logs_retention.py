@@ -0,0 +1,151 @@
+"""
+Retention for the partitioned logs table (migration 0008)
+Run daily (cron / Render job):
+
+    python scripts/logs_retention.py            # create upcoming partitions, archive old ones
+    python scripts/logs_retention.py --drop     # old partitions are dropped without archiving
+    python scripts/logs_retention.py list
+    python scripts/logs_retention.py restore archive/logs/logs_2026_01.csv.gz
+
+Archived months are written as gzip CSV to LOGS_ARCHIVE_DIR, then detached and dropped.
+A restored month is archived again by the next run while it is older than the retention.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+from datetime import date
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from database import engine
+
+# Months kept in the database besides the current one
+LOGS_RETENTION_MONTHS = int(os.getenv("LOGS_RETENTION_MONTHS", "6"))
+# Monthly partitions created ahead of time, so inserts never land in logs_default
+LOGS_PARTITIONS_AHEAD = int(os.getenv("LOGS_PARTITIONS_AHEAD", "3"))
+LOGS_ARCHIVE_DIR = os.getenv(
+    "LOGS_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "archive", "logs")
+)
+
+LOG_COLUMNS = "id, job_id, carteirinha_id, level, message, created_at"
+PARTITION_NAME = re.compile(r"logs_(\d{4})_(\d{2})")
+
+def month_partitions(connection):
+    """(month, partition name) of every monthly partition, oldest first."""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'logs'::regclass"
+    )).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.fullmatch(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+def first_kept_month(today: date) -> date:
+    months = today.year * 12 + today.month - 1 - LOGS_RETENTION_MONTHS
+    return date(months // 12, months % 12 + 1, 1)
+
+def ensure_partitions():
+    with engine.begin() as connection:
+        created = connection.execute(text(
+            "SELECT ensure_logs_partition("
+            "(date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => n))::date) "
+            "FROM generate_series(0, :ahead) AS n"
+        ), {"ahead": LOGS_PARTITIONS_AHEAD}).scalars().all()
+    print(f"✓ Partitions ready: {', '.join(created)}")
+
+def archive_partition(name: str, drop_only: bool = False):
+    path = os.path.join(LOGS_ARCHIVE_DIR, f"{name}.csv.gz")
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        # No writes to the month between the copy and the detach
+        cursor.execute(f'LOCK TABLE "{name}" IN SHARE MODE')
+        if not drop_only:
+            os.makedirs(LOGS_ARCHIVE_DIR, exist_ok=True)
+            with gzip.open(path + ".tmp", "wb") as f:
+                cursor.copy_expert(f'COPY "{name}" ({LOG_COLUMNS}) TO STDOUT WITH (FORMAT csv, HEADER)', f)
+            os.replace(path + ".tmp", path)
+        cursor.execute(f'ALTER TABLE logs DETACH PARTITION "{name}"')
+        cursor.execute(f'DROP TABLE "{name}"')
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    print(f"✓ {name}: {'dropped' if drop_only else f'archived to {path}'}")
+
+def apply_retention(drop_only: bool = False, dry_run: bool = False):
+    limit = first_kept_month(date.today())
+    with engine.connect() as connection:
+        expired = [name for month, name in month_partitions(connection) if month < limit]
+    if not expired:
+        print(f"✓ Nothing older than {limit:%Y-%m}")
+    for name in expired:
+        if dry_run:
+            print(f"- {name} would be {'dropped' if drop_only else 'archived'}")
+        else:
+            archive_partition(name, drop_only)
+
+def list_partitions():
+    with engine.connect() as connection:
+        for month, name in month_partitions(connection):
+            rows = connection.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+            print(f"{month:%Y-%m}  {name}  {rows} rows")
+        rows = connection.execute(text("SELECT count(*) FROM logs_default")).scalar()
+        print(f"default  logs_default  {rows} rows")
+
+def restore_archive(path: str):
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("CREATE TEMP TABLE logs_restore (LIKE logs) ON COMMIT DROP")
+        with gzip.open(path, "rb") as f:
+            cursor.copy_expert(f"COPY logs_restore ({LOG_COLUMNS}) FROM STDIN WITH (FORMAT csv, HEADER)", f)
+        cursor.execute(
+            "SELECT ensure_logs_partition(month::date) FROM ("
+            "SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') AS month FROM logs_restore) months"
+        )
+        # Jobs / carteirinhas deleted since the archive: same as ON DELETE SET NULL
+        cursor.execute(
+            f"INSERT INTO logs ({LOG_COLUMNS}) "
+            "SELECT r.id, j.id, c.id, r.level, r.message, r.created_at FROM logs_restore r "
+            "LEFT JOIN jobs j ON j.id = r.job_id "
+            "LEFT JOIN carteirinhas c ON c.id = r.carteirinha_id "
+            "ON CONFLICT DO NOTHING"
+        )
+        restored = cursor.rowcount
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    print(f"✓ {path}: {restored} logs restored")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition maintenance and archival for the logs table")
+    parser.add_argument("--drop", action="store_true", help="drop old partitions without archiving them")
+    parser.add_argument("--dry-run", action="store_true", help="only show which partitions would go")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("list", help="monthly partitions and their row counts")
+    restore = commands.add_parser("restore", help="reload archived months")
+    restore.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_partitions()
+    elif args.command == "restore":
+        for path in args.files:
+            restore_archive(path)
+    else:
+        ensure_partitions()
+        apply_retention(drop_only=args.drop, dry_run=args.dry_run)
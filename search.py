@@ -0,0 +1,71 @@
+"""
+Patient search for the carteirinhas and PEI lists.
+
+Free text goes through the trigram GIN indexes created in migration 0006
+(accent/case-folded patient names, card numbers, therapy codes). Numeric
+IDs and complete card numbers take exact-match paths on the btree indexes.
+"""
+import re
+
+from sqlalchemy import Float, case, cast, func, or_
+
+from models import Carteirinha, PatientPei
+
+# A complete card number: 0064.8000.400948.00-5
+CARD_NUMBER = re.compile(r"\d{4}\.\d{4}\.\d{6}\.\d{2}-\d")
+# id_paciente / id_pagamento are INTEGER columns
+MAX_INTEGER = 2 ** 31 - 1
+
+
+def like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def folded(expr):
+    # Must match the indexed expression in migration 0006
+    return func.f_unaccent(func.lower(expr))
+
+
+def _name_match(term: str):
+    return folded(Carteirinha.paciente).like(func.f_unaccent(like_pattern(term.lower())), escape="\\")
+
+
+def _name_rank(term: str):
+    # float8 so the value survives a round trip through a pagination cursor,
+    # never NULL (rows without a name) so it can be compared in a keyset condition
+    similarity = func.word_similarity(func.f_unaccent(term.lower()), folded(Carteirinha.paciente))
+    return func.coalesce(cast(similarity, Float), 0.0)
+
+
+def carteirinha_search(term: str):
+    """Return (where clause, rank expression or None) for a search over carteirinhas."""
+    term = term.strip()
+
+    if CARD_NUMBER.fullmatch(term):
+        # Unique column: at most one row, nothing to rank
+        return Carteirinha.carteirinha == term, None
+
+    number_match = Carteirinha.carteirinha.like(like_pattern(term), escape="\\")
+
+    if term.isascii() and term.isdigit():
+        if int(term) > MAX_INTEGER:
+            return number_match, None
+        id_match = (Carteirinha.id_paciente == int(term)) | (Carteirinha.id_pagamento == int(term))
+        # Exact ID hits first
+        return or_(id_match, number_match), cast(case((id_match, 1.0), else_=0.0), Float)
+
+    return or_(_name_match(term), number_match), _name_rank(term)
+
+
+def pei_search(term: str):
+    """Where clause for a search over patient_pei joined with carteirinhas."""
+    term = term.strip()
+    if CARD_NUMBER.fullmatch(term):
+        return Carteirinha.carteirinha == term
+
+    return or_(
+        _name_match(term),
+        Carteirinha.carteirinha.like(like_pattern(term), escape="\\"),
+        func.lower(PatientPei.codigo_terapia).like(like_pattern(term.lower()), escape="\\")
+    )
@@ -0,0 +1,127 @@
+"""
+API-key authentication shared by all routers.
+
+Users are looked up by key through an in-process LRU+TTL cache, so checking
+the bearer token normally costs no database round trip. Status and validade
+are re-checked on every request against the cached row; any ORM write to a
+User drops its cache entry. Unknown keys are only cached for a few seconds:
+a key created by another process (scripts/create_admin_user.py, another
+worker) is accepted right after.
+"""
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from database import get_async_db, get_db
+from models import User
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+# How long an unknown key stays cached as such
+AUTH_MISS_CACHE_TTL = float(os.getenv("AUTH_MISS_CACHE_TTL", "5"))
+# When enabled, every router except /auth requires a valid bearer key
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "yes")
+
+user_cache = TTLCache(ttl=AUTH_CACHE_TTL, maxsize=AUTH_CACHE_SIZE)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def _entry_ttl(user: Optional[dict]) -> float:
+    return AUTH_CACHE_TTL if user else min(AUTH_MISS_CACHE_TTL, AUTH_CACHE_TTL)
+
+
+def get_user_by_key(db: Session, api_key: str) -> Optional[dict]:
+    # Unknown keys are cached too (as None, briefly), so a client retrying with a
+    # stale key doesn't hit the database on every reconnect
+    def load():
+        row = db.execute(
+            select(User.id, User.username, User.status, User.validade).where(User.api_key == api_key)
+        ).first()
+        return dict(row._mapping) if row else None
+
+    return user_cache.get_or_load(api_key, load, ttl=_entry_ttl)
+
+
+async def get_user_by_key_async(db, api_key: str) -> Optional[dict]:
+    async def load():
+        row = (await db.execute(
+            select(User.id, User.username, User.status, User.validade).where(User.api_key == api_key)
+        )).first()
+        return dict(row._mapping) if row else None
+
+    return await user_cache.get_or_load_async(api_key, load, ttl=_entry_ttl)
+
+
+def check_user(user: Optional[dict]):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Chave de acesso inválida."
+        )
+
+    # Check if active
+    if user["status"] != "Ativo":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuário inativo."
+        )
+
+    # Check validity
+    if user["validade"] and user["validade"] < datetime.now().date():
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Chave está vencida. Contratar nova."
+        )
+
+
+def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: Session = Depends(get_db)
+) -> dict:
+    """FastAPI dependency: the active user owning the `Authorization: Bearer <key>` header."""
+    _require_credentials(credentials)
+    user = get_user_by_key(db, credentials.credentials)
+    check_user(user)
+    return user
+
+
+def _require_credentials(credentials):
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Não autenticado.",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+async def get_current_user_async(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db=Depends(get_async_db)
+) -> dict:
+    """get_current_user() for the async routers: no threadpool thread per request."""
+    _require_credentials(credentials)
+    user = await get_user_by_key_async(db, credentials.credentials)
+    check_user(user)
+    return user
+
+
+def invalidate_user(api_key: Optional[str] = None):
+    """Drop one key (or every key) from the cache; call after changing users outside the ORM."""
+    user_cache.invalidate(api_key)
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.api_key)
+    # The previous key too, when the key itself was changed
+    for old_key in inspect(target).attrs.api_key.history.deleted:
+        invalidate_user(old_key)